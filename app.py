@@ -1,21 +1,48 @@
 import streamlit as st
 import pandas as pd
-from pdf_processor import process_pdf_file, process_image_file
+from pdf_processor import process_report_bytes, file_digest
 from llm_analyzer import analyze_results
-from rag_chatbot import get_chatbot_response
+from rag_chatbot import stream_chatbot_response, knowledge_base
 from medical_history_viz import show_medical_history_visualization
-from export_handler import export_to_csv, export_to_json, export_to_html
-from whatsapp_handler import send_whatsapp_message
+from export_handler import (
+    export_to_csv, export_to_json, export_to_html, export_batch_to_csv, export_batch_to_json,
+    export_patient_reports_to_csv
+)
+from batch_analysis import expand_uploads, directory_reports, iter_batch_results
+from whatsapp_handler import send_whatsapp_message, send_bulk_whatsapp_messages, validate_phone_number
+from patient_repository import repository
 import os
 
+def save_current_report(assessment, patient_number, filename, digest):
+    """Store the analyzed report once per uploaded file and patient, updating it when values are corrected.
+
+    Manually entered values have no file to tie them to, so changed values
+    are stored as a new report rather than overwriting the previous one.
+    """
+    report_key = (digest, patient_number)
+    parameters = dict(st.session_state.parameters)
+    same_report = st.session_state.current_report_id is not None and st.session_state.current_report_key == report_key
+    if same_report and st.session_state.saved_parameters == parameters:
+        return
+    if same_report and digest is not None:
+        repository.update_report(st.session_state.current_report_id, parameters, assessment)
+    else:
+        st.session_state.current_report_id = repository.save_report(
+            parameters, assessment, patient_number=patient_number, filename=filename, file_digest=digest
+        )
+        st.session_state.current_report_key = report_key
+        st.session_state.pathologist_notes = None
+    st.session_state.saved_parameters = parameters
+
 def main():
     st.set_page_config(page_title="Hemoglobinopathy Analysis", layout="wide")
 
+    # Load the chatbot knowledge base in the background (no-op after the first run)
+    knowledge_base.warm_up()
+
     st.title("Hemoglobinopathy Analysis System")
 
-    # Initialize session state
-    if 'registered_patients' not in st.session_state:
-        st.session_state.registered_patients = set()
+    # Initialize session state (patients, reports and reviews are kept in the patient repository)
     if 'parameters' not in st.session_state:
         st.session_state.parameters = {
             'RBC': None,
@@ -33,9 +60,17 @@ def main():
         st.session_state.current_assessment = None
     if 'pathologist_notes' not in st.session_state:
         st.session_state.pathologist_notes = None
+    if 'batch_results' not in st.session_state:
+        st.session_state.batch_results = None
+    if 'uploaded_file_digest' not in st.session_state:
+        st.session_state.uploaded_file_digest = None
+    if 'current_report_id' not in st.session_state:
+        st.session_state.current_report_id = None
+        st.session_state.current_report_key = None
+        st.session_state.saved_parameters = None
 
     # Create tabs for different sections
-    tabs = st.tabs(["Analysis", "Patient Management", "Medical History", "Chatbot"])
+    tabs = st.tabs(["Analysis", "Patient Management", "Medical History", "Chatbot", "Batch Analysis"])
 
     # Patient Management Tab
     with tabs[1]:
@@ -68,14 +103,14 @@ You can:
 1. Ask questions about hemoglobinopathies
 2. Contact your doctor by starting your message with 'doctor:'
 3. Get immediate AI assistance for medical queries
-4. Access your test results and medical history
+4. Access your test results and medical history (reply 'results')
 
 Reply with any question to get started!
 
 For technical support, please contact our help desk."""
 
                     if send_whatsapp_message(patient_number, welcome_message):
-                        st.session_state.registered_patients.add(patient_number)
+                        repository.register_patient(validate_phone_number(patient_number))
                         st.success(f"Successfully registered patient and sent welcome message to: {patient_number}")
                     else:
                         st.error("""
@@ -90,11 +125,43 @@ For technical support, please contact our help desk."""
                 st.warning("Please enter a valid WhatsApp number")
 
         # Display registered patients
-        if st.session_state.registered_patients:
+        registered_patients = repository.list_patients()
+        if registered_patients:
             st.subheader("Registered Patients")
-            for number in st.session_state.registered_patients:
+            for number in registered_patients:
                 st.code(number)
 
+            # Download a patient's stored reports
+            history_patient = st.selectbox("Patient report history", registered_patients)
+            st.download_button(
+                "Download Report History (CSV)",
+                export_patient_reports_to_csv(history_patient),
+                file_name="patient_reports.csv",
+                mime="text/csv"
+            )
+
+            # Broadcast to all registered patients (e.g. results ready, appointment reminders)
+            with st.form("patient_broadcast"):
+                broadcast_message = st.text_area("Message to all registered patients")
+                submit_broadcast = st.form_submit_button("Send to All")
+
+                if submit_broadcast and broadcast_message.strip():
+                    with st.spinner("Sending messages..."):
+                        results = send_bulk_whatsapp_messages(
+                            registered_patients, broadcast_message.strip()
+                        )
+                    sent = sum(1 for result in results.values() if result["status"] == "sent")
+                    if sent == len(results):
+                        st.success(f"Message sent to all {sent} patients")
+                    else:
+                        st.warning(f"Message sent to {sent} of {len(results)} patients")
+                    st.dataframe(pd.DataFrame([
+                        {"Patient": number, "Status": result["status"], "Error": result["error"] or ""}
+                        for number, result in results.items()
+                    ]))
+                elif submit_broadcast:
+                    st.warning("Please enter a message to send")
+
         # WhatsApp Integration Info
         st.header("WhatsApp Integration")
         st.info("""
@@ -116,75 +183,82 @@ For technical support, please contact our help desk."""
 
         if uploaded_file:
             try:
-                # Process the uploaded file
-                if uploaded_file.type == "application/pdf":
-                    results = process_pdf_file(uploaded_file)
-                else:
-                    results = process_image_file(uploaded_file)
-
-                # Update session state with extracted values
-                st.session_state.parameters.update(results)
+                # Streamlit reruns this on every interaction; only a new file is extracted and applied,
+                # so manual edits below are kept and identical files are served from the cache
+                data = uploaded_file.getvalue()
+                digest = file_digest(data)
+                if st.session_state.uploaded_file_digest != digest:
+                    # Recorded first so a file that fails to extract is not retried on every rerun
+                    st.session_state.uploaded_file_digest = digest
+                    results = process_report_bytes(data, uploaded_file.type == "application/pdf", digest)
+
+                    # Update session state with extracted values
+                    st.session_state.parameters.update(results)
 
             except Exception as e:
                 st.warning(f"Could not automatically extract all values. You can enter them manually below.")
 
+        # Patient the report belongs to, so it is kept in their history
+        report_patient = st.selectbox("Patient", [None] + repository.list_patients(),
+                                      format_func=lambda number: number or "Not linked to a patient")
+
         # Parameters input section
         st.header("Blood Test Parameters")
-        st.info("You can manually enter or adjust these values if needed")
+        st.info("You can manually enter or adjust these values if needed. Leave a value empty if it was not measured.")
 
         col1, col2 = st.columns(2)
 
         with col1:
             st.session_state.parameters['RBC'] = st.number_input(
                 "RBC", 
-                value=float(st.session_state.parameters['RBC']) if st.session_state.parameters['RBC'] is not None else 0.0,
+                value=float(st.session_state.parameters['RBC']) if st.session_state.parameters['RBC'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['HGB'] = st.number_input(
                 "HGB",
-                value=float(st.session_state.parameters['HGB']) if st.session_state.parameters['HGB'] is not None else 0.0,
+                value=float(st.session_state.parameters['HGB']) if st.session_state.parameters['HGB'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['MCV'] = st.number_input(
                 "MCV",
-                value=float(st.session_state.parameters['MCV']) if st.session_state.parameters['MCV'] is not None else 0.0,
+                value=float(st.session_state.parameters['MCV']) if st.session_state.parameters['MCV'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['MCH'] = st.number_input(
                 "MCH",
-                value=float(st.session_state.parameters['MCH']) if st.session_state.parameters['MCH'] is not None else 0.0,
+                value=float(st.session_state.parameters['MCH']) if st.session_state.parameters['MCH'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['MCHC'] = st.number_input(
                 "MCHC",
-                value=float(st.session_state.parameters['MCHC']) if st.session_state.parameters['MCHC'] is not None else 0.0,
+                value=float(st.session_state.parameters['MCHC']) if st.session_state.parameters['MCHC'] is not None else None,
                 format="%.2f"
             )
 
         with col2:
             st.session_state.parameters['RDW'] = st.number_input(
                 "RDW",
-                value=float(st.session_state.parameters['RDW']) if st.session_state.parameters['RDW'] is not None else 0.0,
+                value=float(st.session_state.parameters['RDW']) if st.session_state.parameters['RDW'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['F_concentration'] = st.number_input(
                 "F Concentration",
-                value=float(st.session_state.parameters['F_concentration']) if st.session_state.parameters['F_concentration'] is not None else 0.0,
+                value=float(st.session_state.parameters['F_concentration']) if st.session_state.parameters['F_concentration'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['A2_concentration'] = st.number_input(
                 "A2 Concentration",
-                value=float(st.session_state.parameters['A2_concentration']) if st.session_state.parameters['A2_concentration'] is not None else 0.0,
+                value=float(st.session_state.parameters['A2_concentration']) if st.session_state.parameters['A2_concentration'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['Ao_peak'] = st.number_input(
                 "Ao Peak",
-                value=float(st.session_state.parameters['Ao_peak']) if st.session_state.parameters['Ao_peak'] is not None else 0.0,
+                value=float(st.session_state.parameters['Ao_peak']) if st.session_state.parameters['Ao_peak'] is not None else None,
                 format="%.2f"
             )
             st.session_state.parameters['S_peak'] = st.number_input(
                 "S Peak",
-                value=float(st.session_state.parameters['S_peak']) if st.session_state.parameters['S_peak'] is not None else 0.0,
+                value=float(st.session_state.parameters['S_peak']) if st.session_state.parameters['S_peak'] is not None else None,
                 format="%.2f"
             )
 
@@ -194,23 +268,22 @@ For technical support, please contact our help desk."""
                 # Get system assessment using current parameters
                 assessment = analyze_results(st.session_state.parameters)
                 st.session_state.current_assessment = assessment
+                save_current_report(
+                    assessment,
+                    report_patient,
+                    uploaded_file.name if uploaded_file else None,
+                    st.session_state.uploaded_file_digest if uploaded_file else None
+                )
 
                 st.header("Analysis")
-                col3, col4 = st.columns(2)
-
-                with col3:
-                    st.subheader("System Assessment")
-                    st.write(assessment['system_assessment'])
-
-                with col4:
-                    st.subheader("Pathologist Review")
-                    st.session_state.pathologist_notes = st.text_area(
-                        "Enter pathologist notes",
-                        value=st.session_state.pathologist_notes if st.session_state.pathologist_notes else "",
-                        height=150
-                    )
-                    if st.button("Save Pathologist Review"):
-                        st.success("Pathologist review saved successfully")
+                st.subheader("System Assessment")
+                st.write(assessment['system_assessment'])
+                if assessment.get('analysis_path') == 'rules':
+                    st.caption("Classified by the rule-based screen")
+                elif assessment.get('cached'):
+                    st.caption("Assessed by the AI model (cached result for these values)")
+                else:
+                    st.caption("Assessed by the AI model")
 
                 # Export section
                 st.header("Export Results")
@@ -270,6 +343,26 @@ For technical support, please contact our help desk."""
             except Exception as e:
                 st.error(f"Error in analysis: {str(e)}")
 
+        # Kept outside the Analyze button, which is False again on the rerun the Save button triggers
+        if st.session_state.current_report_id is not None:
+            st.subheader("Pathologist Review")
+            with st.form(f"pathologist_review_{st.session_state.current_report_id}"):
+                notes = st.text_area(
+                    "Enter pathologist notes",
+                    value=st.session_state.pathologist_notes or "",
+                    height=150
+                )
+                if st.form_submit_button("Save Pathologist Review"):
+                    if notes.strip():
+                        try:
+                            repository.add_pathologist_note(st.session_state.current_report_id, notes.strip())
+                            st.session_state.pathologist_notes = notes.strip()
+                            st.success("Pathologist review saved successfully")
+                        except Exception as e:
+                            st.error(f"Error saving pathologist review: {str(e)}")
+                    else:
+                        st.warning("Please enter notes before saving")
+
     # Medical History Tab
     with tabs[2]:
         show_medical_history_visualization()
@@ -281,12 +374,88 @@ For technical support, please contact our help desk."""
 
         user_question = st.text_input("Ask a question:")
         if user_question:
-            with st.spinner("Getting answer..."):
-                try:
-                    response = get_chatbot_response(user_question)
-                    st.write("Answer:", response)
-                except Exception as e:
-                    st.error(f"Error getting response: {str(e)}")
+            try:
+                # Tokens are rendered as they arrive; timings is filled in while streaming
+                timings = {}
+                st.write("Answer:")
+                st.write_stream(stream_chatbot_response(user_question, timings))
+                st.caption(
+                    f"Retrieval {timings['retrieval']:.2f}s · "
+                    f"first token {timings.get('first_token', timings['total']):.2f}s · "
+                    f"total {timings['total']:.2f}s"
+                )
+            except Exception as e:
+                st.error(f"Error getting response: {str(e)}")
+
+    # Batch Analysis Tab
+    with tabs[4]:
+        st.header("Batch Analysis")
+        st.write("Extract and analyze many reports at once, then download the combined results.")
+
+        batch_files = st.file_uploader(
+            "Choose PDF/image reports or ZIP archives of them",
+            type=['pdf', 'png', 'jpg', 'jpeg', 'zip'],
+            accept_multiple_files=True
+        )
+        batch_directory = st.text_input("Or a directory of reports on the server (optional)")
+        analysis_workers = st.slider("Parallel analyses", min_value=1, max_value=16, value=4)
+
+        if st.button("Run Batch Analysis"):
+            try:
+                reports = expand_uploads([(f.name, f.getvalue()) for f in batch_files or []])
+                if batch_directory:
+                    if not os.path.isdir(batch_directory):
+                        raise ValueError(f"Directory not found: {batch_directory}")
+                    reports += directory_reports(batch_directory)
+
+                if not reports:
+                    st.warning("Please upload reports or enter a directory containing them")
+                else:
+                    progress_bar = st.progress(0.0)
+                    status = st.empty()
+                    order = {name: i for i, (name, _) in enumerate(reports)}
+                    results = []
+                    for result in iter_batch_results(reports, analysis_workers=analysis_workers):
+                        if result['status'] == 'ok':
+                            repository.save_report(result['parameters'], result['assessment'],
+                                                   filename=result['filename'])
+                        results.append(result)
+                        progress_bar.progress(len(results) / len(reports))
+                        status.text(f"Processed {len(results)} of {len(reports)}: {result['filename']}")
+                    st.session_state.batch_results = sorted(results, key=lambda r: order[r['filename']])
+            except Exception as e:
+                st.error(f"Error running batch analysis: {str(e)}")
+
+        if st.session_state.batch_results:
+            results = st.session_state.batch_results
+            failed = sum(1 for r in results if r['status'] == 'error')
+            st.subheader("Results")
+            st.write(f"{len(results) - failed} of {len(results)} reports analyzed successfully")
+            st.dataframe(pd.DataFrame([
+                {
+                    "File": r['filename'],
+                    "Status": r['status'],
+                    "Path": (r['assessment'] or {}).get('analysis_path', ''),
+                    "Error": r['error'] or ""
+                }
+                for r in results
+            ]))
+
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button(
+                    "Download Combined CSV",
+                    export_batch_to_csv(results),
+                    file_name="batch_analysis.csv",
+                    mime="text/csv"
+                )
+            with col2:
+                st.download_button(
+                    "Download Combined JSON",
+                    export_batch_to_json(results),
+                    file_name="batch_analysis.json",
+                    mime="application/json"
+                )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
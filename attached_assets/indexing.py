@@ -1,67 +1,652 @@
 import os
+import re
+import sys
+import json
+import bisect
+import time
+import hashlib
+import tempfile
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pypdf
-from sentence_transformers import SentenceTransformer
 import faiss
 import numpy as np
 
+# Shared modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunk_store import ChunkStore, write_chunk_store
+from embeddings import get_embedding_backend, write_index_metadata, read_index_metadata, approximate_token_starts
+from dedup import NearDuplicateIndex, simhash
+
 # 1. Load PDF documents from the 'data' directory
+PAGES_PER_TASK = 8
+
+def count_pdf_pages(filepath):
+    with open(filepath, 'rb') as f:
+        return len(pypdf.PdfReader(f).pages)
+
+def extract_page_range(filepath, start, end):
+    """Extract the text of pages [start, end) of a PDF (runs in a worker process)"""
+    with open(filepath, 'rb') as f:
+        reader = pypdf.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+def _make_document(filename, pages):
+    # Joined once per document rather than concatenated page by page
+    return {"filename": filename, "pages": pages, "content": "".join(pages)}
+
+def load_pdf_document(data_dir, filename):
+    filepath = os.path.join(data_dir, filename)
+    return _make_document(filename, extract_page_range(filepath, 0, count_pdf_pages(filepath)))
+
 def load_pdf_documents(data_dir='data'):
     documents = []
     for filename in os.listdir(data_dir):
         if filename.endswith('.pdf'):
-            filepath = os.path.join(data_dir, filename)
-            with open(filepath, 'rb') as f:
-                reader = pypdf.PdfReader(f)
-                text = ""
-                for page in reader.pages:
-                    text += page.extract_text()
-                documents.append({"filename": filename, "content": text})
+            documents.append(load_pdf_document(data_dir, filename))
     return documents
 
-# 2. Chunk documents (simple chunking by page for now, can be improved)
-def chunk_documents(documents, chunk_size=500, chunk_overlap=50):
-    chunks = []
+def _bounded_map(executor, fn, tasks, max_pending):
+    """Ordered (key, fn(*args)) for (key, args) tasks, with at most max_pending in flight"""
+    pending = deque()
+    for key, args in tasks:
+        pending.append((key, executor.submit(fn, *args)))
+        if len(pending) >= max_pending:
+            key, future = pending.popleft()
+            yield key, future.result()
+    while pending:
+        key, future = pending.popleft()
+        yield key, future.result()
+
+def iter_pdf_documents(data_dir, filenames, workers=None):
+    """Yield documents in the given order, extracting page ranges in a process pool.
+
+    Large PDFs are split into PAGES_PER_TASK-page tasks so one book spreads
+    across all cores. Only a bounded number of tasks is queued ahead of the
+    consumer, which keeps memory flat when embedding is the slower stage.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for filename in filenames:
+            yield load_pdf_document(data_dir, filename)
+        return
+
+    def tasks():
+        for filename in filenames:
+            filepath = os.path.join(data_dir, filename)
+            num_pages = count_pdf_pages(filepath)
+            for start in range(0, max(num_pages, 1), PAGES_PER_TASK):
+                yield filename, (filepath, start, min(start + PAGES_PER_TASK, num_pages))
+
+    # Spawned rather than forked: the embedding model may already be running threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        current, pages = None, []
+        for filename, page_texts in _bounded_map(executor, extract_page_range, tasks(), workers * 2):
+            if current is not None and filename != current:
+                yield _make_document(current, pages)
+                pages = []
+            current = filename
+            pages.extend(page_texts)
+        if current is not None:
+            yield _make_document(current, pages)
+
+# 2. Chunk documents along page, section and sentence boundaries, sized in tokens
+# A boundary is a blank line or numbered heading (section) or the end of a sentence
+_BOUNDARY = re.compile(
+    r"(?P<section>\n[ \t]*\n\s*|\n(?=\d+(?:\.\d+)*\.?[ \t]+[A-Z]))"
+    r"|(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])"
+)
+_WORD = re.compile(r"\S+")
+
+def _iter_segments(content, page_starts):
+    """Yield (start, end, hard) spans between boundaries in one pass over the text.
+
+    hard is True when the span follows a page or section break.
+    """
+    pages = iter(page_starts[1:])
+    next_page = next(pages, None)
+    position, hard = 0, True
+    for match in _BOUNDARY.finditer(content):
+        # Page breaks falling before this boundary split the current span
+        while next_page is not None and next_page < match.start():
+            if next_page > position:
+                yield position, next_page, hard
+                position, hard = next_page, True
+            next_page = next(pages, None)
+        if match.start() > position:
+            yield position, match.start(), hard
+        position = match.end()
+        hard = bool(match.group("section"))
+        # A page break inside the boundary whitespace starts the next span on a new page
+        while next_page is not None and next_page <= position:
+            hard = True
+            next_page = next(pages, None)
+    while next_page is not None:
+        if next_page > position:
+            yield position, next_page, hard
+            position, hard = next_page, True
+        next_page = next(pages, None)
+    if len(content) > position:
+        yield position, len(content), hard
+
+def _chunk_document(doc, max_tokens, overlap_tokens, token_starts):
+    content = doc["content"]
+    page_starts = [0]
+    for page in doc.get("pages", [])[:-1]:
+        page_starts.append(page_starts[-1] + len(page))
+    starts = token_starts(content)
+
+    def count_tokens(start, end):
+        return bisect.bisect_left(starts, end) - bisect.bisect_left(starts, start)
+
+    def make_chunk(start, end):
+        # The only copy of the text: one slice per emitted chunk
+        return {
+            "filename": doc["filename"],
+            "chunk": content[start:end],
+            "page_start": bisect.bisect_right(page_starts, start),
+            "page_end": bisect.bisect_right(page_starts, end - 1),
+            "char_start": start,
+            "char_end": end,
+        }
+
+    def split_long(start, end, hard):
+        """Break a sentence longer than the budget at word boundaries"""
+        piece_start = None
+        for word in _WORD.finditer(content, start, end):
+            if piece_start is None:
+                piece_start = word.start()
+            elif count_tokens(piece_start, word.end()) > max_tokens:
+                yield piece_start, previous_end, hard
+                piece_start, hard = word.start(), False
+            previous_end = word.end()
+        if piece_start is not None:
+            yield piece_start, previous_end, hard
+
+    window = deque()  # (start, end, tokens) of the sentences in the current chunk
+    total = 0
+    for segment_start, segment_end, hard in _iter_segments(content, page_starts):
+        segment_tokens = count_tokens(segment_start, segment_end)
+        if not segment_tokens:
+            continue
+        pieces = [(segment_start, segment_end, hard)]
+        if segment_tokens > max_tokens:
+            pieces = split_long(segment_start, segment_end, hard)
+        for start, end, hard in pieces:
+            tokens = count_tokens(start, end)
+            # Close the chunk when full, or at a page/section break once it is reasonably sized
+            if window and (total + tokens > max_tokens or (hard and total >= max_tokens // 2)):
+                yield make_chunk(window[0][0], window[-1][1])
+                if hard:
+                    window.clear()
+                    total = 0
+                # Carry trailing sentences into the next chunk as overlap
+                while window and (total > overlap_tokens or total + tokens > max_tokens):
+                    total -= window.popleft()[2]
+            window.append((start, end, tokens))
+            total += tokens
+    if window:
+        yield make_chunk(window[0][0], window[-1][1])
+
+def iter_document_chunks(documents, max_tokens=256, overlap_tokens=32, token_starts=None):
+    """Yield chunks of at most max_tokens tokens that end on sentence boundaries.
+
+    Chunks start afresh at page and section breaks once they hold half the
+    budget, overlap by up to overlap_tokens of whole sentences otherwise,
+    and record their page range and character offsets in the document.
+    token_starts maps a text to its token start offsets (approximated as
+    words and punctuation by default).
+    """
+    token_starts = token_starts or approximate_token_starts
     for doc in documents:
-        content = doc["content"]
-        filename = doc["filename"]
-        # Simple chunking by sliding window
-        for i in range(0, len(content), chunk_size - chunk_overlap):
-            chunk = content[i:i + chunk_size]
-            chunks.append({"filename": filename, "chunk": chunk})
-    return chunks
-
-# 3. Create embeddings using sentence-transformers model
-def create_embeddings(chunks):
-    model = SentenceTransformer('sentence-transformers/all-mpnet-base-v2')
-    embeddings = model.encode([chunk["chunk"] for chunk in chunks])
+        yield from _chunk_document(doc, max_tokens, overlap_tokens, token_starts)
+
+def chunk_documents(documents, max_tokens=256, overlap_tokens=32, token_starts=None):
+    return list(iter_document_chunks(documents, max_tokens, overlap_tokens, token_starts))
+
+# 3. Create embeddings with the configured backend (local sentence-transformers by default)
+def create_embeddings(chunks, backend=None):
+    backend = backend or get_embedding_backend()
+    embeddings = backend.embed([chunk["chunk"] for chunk in chunks])
     return embeddings
 
 # 4. Build FAISS index
-def build_faiss_index(embeddings):
+INDEX_TYPES = ["flat", "ivf-flat", "ivf-pq", "hnsw"]
+
+def default_nlist(num_vectors):
+    """Rule-of-thumb number of IVF cells (about 4 * sqrt(n))"""
+    return max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39 or 1))
+
+def training_sample(embeddings, sample_size, seed=0):
+    """Random subset of the embeddings used to train IVF/PQ quantizers"""
+    if sample_size >= len(embeddings):
+        return embeddings
+    rng = np.random.default_rng(seed)
+    return embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+
+def default_training_size(index_type, nlist=None, pq_nbits=8):
+    """Enough vectors per IVF cell / PQ centroid for stable training"""
+    size = 10_000
+    if nlist:
+        size = max(size, 39 * nlist)
+    if index_type == "ivf-pq":
+        size = max(size, 39 * 2 ** pq_nbits)
+    return size
+
+def create_faiss_index(embeddings, index_type="flat", nlist=None, pq_m=16, pq_nbits=8,
+                       hnsw_m=32, ef_construction=200, train_sample=None, seed=0):
+    """Create an empty index, training IVF quantizers on a sample of the given embeddings"""
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)  # L2 distance for similarity
-    index.add(np.float32(embeddings))
+
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dimension)  # L2 distance for similarity
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type in ("ivf-flat", "ivf-pq"):
+        nlist = nlist or default_nlist(len(embeddings))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf-flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else:
+            if dimension % pq_m:
+                raise ValueError(f"--pq-m ({pq_m}) must divide the embedding dimension ({dimension})")
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_nbits)
+        # Train on a sample: enough points per cell/centroid without touching the whole corpus
+        sample_size = train_sample or default_training_size(index_type, nlist, pq_nbits)
+        index.train(training_sample(embeddings, sample_size, seed))
+    else:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from: {', '.join(INDEX_TYPES)}")
     return index
 
-if __name__ == '__main__':
-    documents = load_pdf_documents()
-    if not documents:
-        print("No PDF documents found in the 'data' directory. Please add PDF files to the 'data' directory.")
+def build_faiss_index(embeddings, index_type="flat", nlist=None, pq_m=16, pq_nbits=8,
+                      hnsw_m=32, ef_construction=200, train_sample=None, seed=0, ids=None):
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    index = create_faiss_index(embeddings, index_type, nlist, pq_m, pq_nbits, hnsw_m, ef_construction,
+                               train_sample, seed)
+    if ids is None:
+        index.add(embeddings)
+        return index
+    # Explicit chunk IDs let incremental runs add and remove vectors per file
+    index = faiss.IndexIDMap2(index)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype='int64'))
+    return index
+
+class StreamingIndexBuilder:
+    """Adds embedding batches to a new or existing ID-mapped index as they are produced.
+
+    A new IVF index must be trained before vectors can be added. Its
+    training sample is drawn uniformly from the whole stream by reservoir
+    sampling, so centroids reflect every file rather than the first few;
+    until the stream ends, batches are spooled to a temporary file instead
+    of being held in memory. Flat and HNSW indexes are created from the
+    first batch.
+    """
+
+    def __init__(self, index=None, index_type="flat", train_sample=None, seed=0, **index_params):
+        self.index = index
+        self.index_type = index_type
+        self.train_sample = train_sample
+        self.index_params = index_params
+        self._rng = np.random.default_rng(seed)
+        self._reservoir = None
+        self._seen = 0
+        self._spool = None
+        self._spooled = []  # rows per spooled batch
+
+    def _sample_size(self):
+        return self.train_sample or default_training_size(
+            self.index_type, self.index_params.get("nlist"), self.index_params.get("pq_nbits", 8)
+        )
+
+    def add(self, embeddings, ids):
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        ids = np.ascontiguousarray(ids, dtype='int64')
+        if self.index is not None:
+            self.index.add_with_ids(embeddings, ids)
+        elif not self.index_type.startswith("ivf"):
+            self.index = build_faiss_index(embeddings, self.index_type, ids=ids, **self.index_params)
+        else:
+            self._sample(embeddings)
+            if self._spool is None:
+                self._spool = tempfile.TemporaryFile()
+            self._spool.write(embeddings.tobytes())
+            self._spool.write(ids.tobytes())
+            self._spooled.append(len(ids))
+
+    def _sample(self, embeddings):
+        """Reservoir sampling (Algorithm R): every vector seen so far is equally likely to be kept"""
+        size = self._sample_size()
+        if self._reservoir is None:
+            self._reservoir = np.empty((size, embeddings.shape[1]), dtype='float32')
+        positions = self._seen + np.arange(len(embeddings))
+        filling = positions < size
+        self._reservoir[positions[filling]] = embeddings[filling]
+        later = np.flatnonzero(~filling)
+        slots = self._rng.integers(0, positions[later] + 1)
+        for row, slot in zip(later[slots < size], slots[slots < size]):
+            self._reservoir[slot] = embeddings[row]
+        self._seen += len(embeddings)
+
+    def finish(self):
+        """Return the index, training a new IVF index on the sample and adding the spooled batches"""
+        if self._spool is None:
+            return self.index
+        sample = self._reservoir[:min(self._seen, len(self._reservoir))]
+        self.index = faiss.IndexIDMap2(
+            create_faiss_index(sample, self.index_type, train_sample=self.train_sample, **self.index_params)
+        )
+        dimension = sample.shape[1]
+        self._spool.seek(0)
+        for rows in self._spooled:
+            embeddings = np.frombuffer(self._spool.read(rows * dimension * 4), dtype='float32').reshape(rows, dimension)
+            ids = np.frombuffer(self._spool.read(rows * 8), dtype='int64')
+            self.index.add_with_ids(embeddings, ids)
+        self._spool.close()
+        self._spool, self._spooled, self._reservoir = None, [], None
+        return self.index
+
+def set_search_parameter(index, name, value):
+    """Set a runtime search parameter (nprobe, efSearch) if the index supports it"""
+    try:
+        faiss.ParameterSpace().set_index_parameter(index, name, value)
+        return True
+    except RuntimeError:
+        return False
+
+# 5. Compare an approximate index against exact search
+def _time_queries(index, queries, k):
+    start = time.perf_counter()
+    results = [index.search(query.reshape(1, -1), k)[1][0] for query in queries]
+    return np.array(results), (time.perf_counter() - start) * 1000 / len(queries)
+
+def evaluate_index(index, embeddings, index_type, k=10, num_queries=200, seed=0):
+    """Print recall@k and per-query latency of the index against brute-force search.
+
+    Queries are sampled corpus vectors, searched one at a time as the chatbot
+    does. IVF indexes are swept over nprobe and HNSW over efSearch.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    queries = training_sample(embeddings, num_queries, seed + 1)
+    flat = faiss.IndexFlatL2(embeddings.shape[1])
+    flat.add(embeddings)
+    exact, flat_ms = _time_queries(flat, queries, k)
+
+    if index_type.startswith("ivf"):
+        nlist = faiss.extract_index_ivf(index).nlist
+        name, values = "nprobe", [v for v in (1, 2, 4, 8, 16, 32, 64, 128) if v <= nlist]
+    elif index_type == "hnsw":
+        name, values = "efSearch", [16, 32, 64, 128, 256]
     else:
-        chunks = chunk_documents(documents)
-        embeddings = create_embeddings(chunks)
-        index = build_faiss_index(embeddings)
-
-        # Save chunks and embeddings for later use in querying
-        np.save("embeddings.npy", embeddings)
-        faiss.write_index(index, "faiss_index.index")
-        # Optionally save chunks to a file for easy retrieval during querying
-        import json
-        with open("chunks.json", 'w') as f:
-            json.dump(chunks, f)
-
-
-        print("PDF documents loaded, chunks created, embeddings generated, and FAISS index built.")
-        print("Embeddings saved to 'embeddings.npy'")
-        print("FAISS index saved to 'faiss_index.index'")
-        print("Chunks saved to 'chunks.json'")
\ No newline at end of file
+        name, values = None, [None]
+
+    print(f"Recall@{k} vs flat index ({len(queries)} queries, flat: {flat_ms:.3f} ms/query)")
+    print(f"{name or 'setting':>10}  {'recall':>7}  {'ms/query':>9}  {'speedup':>7}")
+    for value in values:
+        if name:
+            set_search_parameter(index, name, value)
+        approx, approx_ms = _time_queries(index, queries, k)
+        recall = np.mean([len(set(a) & set(e)) / k for a, e in zip(approx, exact)])
+        print(f"{str(value):>10}  {recall:>7.3f}  {approx_ms:>9.3f}  {flat_ms / approx_ms:>6.1f}x")
+
+# 6. Incremental indexing: a manifest maps each PDF's SHA-256 to its chunk ID range
+MANIFEST_NAME = "index_manifest.json"
+INDEX_NAME = "faiss_index.index"
+CHUNKS_NAME = "chunks.bin"
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def scan_pdf_files(data_dir):
+    """Map the SHA-256 of each PDF in data_dir to its file name (identical copies are indexed once)"""
+    files = {}
+    # Shortest name first, so 'guide.pdf' is kept over its 'guide (1).pdf' copy
+    for filename in sorted(os.listdir(data_dir), key=lambda name: (len(name), name)):
+        if filename.endswith('.pdf'):
+            sha = file_sha256(os.path.join(data_dir, filename))
+            if sha in files:
+                print(f"Skipping '{filename}': identical to '{files[sha]}'")
+            else:
+                files[sha] = filename
+    return files
+
+def empty_manifest():
+    return {"next_id": 0, "files": {}}
+
+def load_index_state(output_dir, backend, index_type, chunk_tokens, chunk_overlap):
+    """Load the index, chunks and manifest of a previous run, or None if a full rebuild is needed"""
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    chunks_path = os.path.join(output_dir, CHUNKS_NAME)
+    if not all(os.path.exists(path) for path in (index_path, manifest_path, chunks_path)):
+        print("No previous incremental index found; building from scratch")
+        return None
+
+    metadata = read_index_metadata(index_path)
+    if (metadata.get("backend"), metadata.get("model")) != (backend.name, backend.model):
+        print(f"Embedding model changed from {metadata.get('model')} to {backend.model}; rebuilding from scratch")
+        return None
+    if metadata.get("index_type", "flat") != index_type:
+        print(f"Index type changed from {metadata.get('index_type', 'flat')} to {index_type}; rebuilding from scratch")
+        return None
+    if (metadata.get("chunk_tokens"), metadata.get("chunk_overlap")) != (chunk_tokens, chunk_overlap):
+        print("Chunking settings changed; rebuilding from scratch")
+        return None
+
+    index = faiss.read_index(index_path)
+    if not isinstance(index, faiss.IndexIDMap2):
+        print("Existing index has no chunk IDs; rebuilding from scratch")
+        return None
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    with ChunkStore(chunks_path) as store:
+        chunks = [store[i] for i in range(len(store))]
+    return index, chunks, manifest
+
+def write_index_files(output_dir, index, chunks, manifest, backend, args):
+    """Write the chunk store, metadata, index and manifest, each atomically.
+
+    The index is replaced after the chunk store, so a chatbot that reloads
+    when the index file changes always finds every chunk ID it returns.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    write_chunk_store(chunks, os.path.join(output_dir, CHUNKS_NAME))
+    # Record the embedding model and search defaults so the chatbot queries the same way
+    write_index_metadata(index_path, backend, index, index_type=args.index_type,
+                         nprobe=args.nprobe, ef_search=args.ef_search,
+                         chunk_tokens=args.chunk_tokens, chunk_overlap=args.chunk_overlap)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_path)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def update_index(args):
+    """Build the index, or with --incremental only embed new/changed PDFs and drop deleted ones"""
+    backend = get_embedding_backend()
+    files = scan_pdf_files(args.data_dir)
+    state = None
+    if args.incremental:
+        state = load_index_state(args.output_dir, backend, args.index_type, args.chunk_tokens, args.chunk_overlap)
+    index, chunks, manifest = state or (None, [], empty_manifest())
+    indexed = manifest["files"]
+
+    removed = [sha for sha in indexed if sha not in files]
+    added = [sha for sha in files if sha not in indexed]
+    renamed = [sha for sha in files if sha in indexed and indexed[sha]["filename"] != files[sha]]
+    if state is not None and not (removed or added or renamed):
+        print("Index is up to date")
+        return
+
+    # Files whose near-duplicate chunks were skipped in favour of a removed file's copy
+    # would lose those passages, so they are re-indexed along with the new files
+    reindexed = [sha for sha in indexed if sha in files and set(indexed[sha].get("duplicates_in", [])) & set(removed)]
+    for sha in reindexed:
+        print(f"Re-indexing '{files[sha]}': it shares passages with a removed file")
+    removed += reindexed
+    added += reindexed
+    # Re-indexed files are added back under their current name
+    renamed = [sha for sha in renamed if sha not in reindexed]
+
+    if removed and index is not None:
+        ids = np.concatenate([
+            np.arange(indexed[sha]["start_id"], indexed[sha]["end_id"], dtype='int64') for sha in removed
+        ])
+        try:
+            index.remove_ids(ids)
+        except RuntimeError:
+            print(f"{args.index_type} indexes do not support removing vectors; rebuilding from scratch")
+            args.incremental = False
+            return update_index(args)
+        for chunk_id in ids:
+            chunks[chunk_id] = None
+    for sha in removed:
+        entry = indexed.pop(sha)
+        if sha not in reindexed:
+            print(f"Removed '{entry['filename']}'")
+
+    for sha in renamed:
+        entry = indexed[sha]
+        for chunk_id in range(entry["start_id"], entry["end_id"]):
+            # Keep the page range and offsets recorded with the chunk
+            chunks[chunk_id] = {**chunks[chunk_id], "filename": files[sha]}
+        print(f"Renamed '{entry['filename']}' to '{files[sha]}'")
+        entry["filename"] = files[sha]
+
+    # Stream: extract pages in parallel -> chunk -> embed in fixed-size batches -> add to the index
+    rebuilt = index is None
+    builder = StreamingIndexBuilder(
+        index, args.index_type, train_sample=args.train_sample, nlist=args.nlist, pq_m=args.pq_m,
+        pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m, ef_construction=args.ef_construction
+    )
+    report_embeddings = [] if args.report and rebuilt else None
+    batch_chunks, batch_ids = [], []
+
+    def embed_batch():
+        embeddings = create_embeddings(batch_chunks, backend)
+        builder.add(embeddings, np.array(batch_ids, dtype='int64'))
+        if report_embeddings is not None:
+            report_embeddings.append(embeddings)
+        batch_chunks.clear()
+        batch_ids.clear()
+
+    # Near-duplicate chunks (the same passage in another edition or copy) are not indexed twice.
+    # Each file records which other files hold the copies its skipped chunks rely on.
+    near_duplicates = None
+    skipped = 0
+    empty_files = []
+    if args.dedup_distance >= 0:
+        near_duplicates = NearDuplicateIndex(args.dedup_distance)
+        for chunk_id, chunk in enumerate(chunks):
+            if chunk is not None:
+                near_duplicates.add(simhash(chunk["chunk"]), chunk_id)
+    owners = sorted((entry["start_id"], entry["end_id"], sha) for sha, entry in indexed.items())
+
+    def owner_of(chunk_id):
+        position = bisect.bisect_right(owners, (chunk_id, float("inf"))) - 1
+        if position >= 0 and chunk_id < owners[position][1]:
+            return owners[position][2]
+        return None
+
+    sha_by_filename = {files[sha]: sha for sha in added}
+    for document in iter_pdf_documents(args.data_dir, list(sha_by_filename), args.workers):
+        start_id = manifest["next_id"]
+        duplicates_in = set()
+        produced = 0
+        for chunk in iter_document_chunks([document], args.chunk_tokens, args.chunk_overlap, backend.token_starts):
+            produced += 1
+            if near_duplicates is not None:
+                fingerprint = simhash(chunk["chunk"])
+                kept_id = near_duplicates.find(fingerprint)
+                if kept_id is not None:
+                    skipped += 1
+                    # None when the kept copy is earlier in this same document
+                    duplicates_in.add(owner_of(kept_id))
+                    continue
+                near_duplicates.add(fingerprint, manifest["next_id"])
+            batch_ids.append(manifest["next_id"])
+            batch_chunks.append(chunk)
+            chunks.append(chunk)
+            manifest["next_id"] += 1
+            if len(batch_chunks) >= args.batch_size:
+                embed_batch()
+        if not produced:
+            empty_files.append(document["filename"])
+        sha = sha_by_filename[document["filename"]]
+        indexed[sha] = {
+            "filename": document["filename"], "start_id": start_id, "end_id": manifest["next_id"],
+            "duplicates_in": sorted(duplicates_in - {None, sha})
+        }
+        owners.append((start_id, manifest["next_id"], sha))
+        print(f"Added '{document['filename']}' ({manifest['next_id'] - start_id} chunks)")
+    if batch_chunks:
+        embed_batch()
+    if skipped:
+        print(f"Skipped {skipped} near-duplicate chunks")
+
+    index = builder.finish()
+    if index is None:
+        if not files:
+            print(f"No PDF documents found in the '{args.data_dir}' directory. Please add PDF files to the '{args.data_dir}' directory.")
+            return
+        # PDFs exist (identical copies are already reduced to one), but none produced a chunk to embed
+        reasons = []
+        if empty_files:
+            reasons.append(f"no text could be extracted from {', '.join(empty_files)}")
+        if skipped:
+            reasons.append(f"all {skipped} remaining chunks were near-duplicates")
+        print(f"Nothing to index in the '{args.data_dir}' directory: {'; '.join(reasons) or 'no chunks were produced'}.")
+        return
+    if args.report:
+        if report_embeddings:
+            evaluate_index(index, np.concatenate(report_embeddings), args.index_type)
+        else:
+            print("Skipping --report: it needs a full build")
+    set_search_parameter(index, "nprobe", args.nprobe)
+    set_search_parameter(index, "efSearch", args.ef_search)
+
+    write_index_files(args.output_dir, index, chunks, manifest, backend, args)
+    print(f"FAISS index saved to '{INDEX_NAME}' ({args.index_type}, {backend.model}, {index.d}-d, {index.ntotal} vectors)")
+    print(f"Chunks saved to '{CHUNKS_NAME}', manifest saved to '{MANIFEST_NAME}'")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the FAISS index used by the RAG chatbot")
+    parser.add_argument("--data-dir", default="data", help="Directory containing the source PDFs")
+    parser.add_argument("--output-dir", default=".", help="Directory to write the index and chunk store to")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only embed new or changed PDFs and remove deleted ones, reusing the previous index")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="flat (exact), ivf-flat, ivf-pq or hnsw (approximate)")
+    parser.add_argument("--nlist", type=int, help="Number of IVF cells (default: about 4 * sqrt(n))")
+    parser.add_argument("--pq-m", type=int, default=16, help="IVF-PQ sub-quantizers; must divide the dimension")
+    parser.add_argument("--pq-nbits", type=int, default=8, help="IVF-PQ bits per sub-quantizer code")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node")
+    parser.add_argument("--ef-construction", type=int, default=200, help="HNSW build-time search depth")
+    parser.add_argument("--train-sample", type=int, help="Number of vectors to train IVF quantizers on")
+    parser.add_argument("--nprobe", type=int, default=16, help="Default IVF cells searched per query")
+    parser.add_argument("--ef-search", type=int, default=64, help="Default HNSW search depth per query")
+    parser.add_argument("--report", action="store_true", help="Print a recall vs latency report against the flat index")
+    parser.add_argument("--workers", type=int, help="Processes extracting PDF pages (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks embedded and added to the index per batch")
+    parser.add_argument("--chunk-tokens", type=int, default=256,
+                        help="Maximum tokens per chunk (keep within the embedding model's input length)")
+    parser.add_argument("--chunk-overlap", type=int, default=32, help="Tokens of whole sentences repeated between chunks")
+    parser.add_argument("--dedup-distance", type=int, default=3,
+                        help="Skip chunks within this SimHash distance (0-3) of an indexed chunk; -1 disables")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    update_index(parse_args())
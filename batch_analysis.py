@@ -0,0 +1,112 @@
+import io
+import os
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pdf_processor import process_report_bytes
+from llm_analyzer import analyze_results
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+DEFAULT_ANALYSIS_WORKERS = 4
+
+
+def is_supported_report(name):
+    return name.lower().endswith(SUPPORTED_EXTENSIONS) and not os.path.basename(name).startswith('.')
+
+
+def expand_uploads(files):
+    """Turn (name, bytes) uploads into (name, bytes) reports, unpacking ZIP archives"""
+    reports = []
+    for name, data in files:
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or info.filename.startswith('__MACOSX/') or not is_supported_report(info.filename):
+                        continue
+                    reports.append((f"{name}/{info.filename}", archive.read(info)))
+        elif is_supported_report(name):
+            reports.append((name, data))
+        else:
+            print(f"Skipping unsupported file: {name}")
+    return reports
+
+
+def directory_reports(directory):
+    """(name, path) reports for the supported files under a directory, in name order"""
+    reports = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if is_supported_report(filename):
+                reports.append((os.path.relpath(path, directory), path))
+    return sorted(reports)
+
+
+def extract_report(name, source):
+    """Extract parameters from a report given as bytes or a file path (runs in a worker process).
+
+    Worker processes share cached extractions only through the EXTRACTION_CACHE_PATH disk tier.
+    """
+    try:
+        if not isinstance(source, (bytes, bytearray)):
+            with open(source, 'rb') as f:
+                source = f.read()
+        parameters = process_report_bytes(source, name.lower().endswith('.pdf'))
+        return {"filename": name, "parameters": parameters, "error": None}
+    except Exception as e:
+        return {"filename": name, "parameters": None, "error": f"Extraction failed: {str(e)}"}
+
+
+def analyze_report(result):
+    """Add the assessment of an extracted report to its result"""
+    if result["error"] is None:
+        try:
+            result["assessment"] = analyze_results(result["parameters"])
+        except Exception as e:
+            result["error"] = f"Analysis failed: {str(e)}"
+    result.setdefault("assessment", None)
+    result["status"] = "error" if result["error"] else "ok"
+    return result
+
+
+def iter_batch_results(reports, extract_workers=None, analysis_workers=DEFAULT_ANALYSIS_WORKERS):
+    """Extract and analyze (name, bytes or path) reports, yielding each result as it completes.
+
+    Extraction runs in a process pool; analyses (mostly waiting on the LLM)
+    run on at most analysis_workers threads, starting as soon as each
+    report's parameters are available.
+    """
+    reports = list(reports)
+    if not reports:
+        return
+    extract_workers = extract_workers or min(os.cpu_count() or 1, len(reports))
+    # Spawned workers do not inherit the threads of the app that started them
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=extract_workers, mp_context=context) as extract_pool, \
+            ThreadPoolExecutor(max_workers=analysis_workers) as analysis_pool:
+        extracting = {extract_pool.submit(extract_report, name, source) for name, source in reports}
+        analyzing = set()
+        while extracting or analyzing:
+            done, _ = wait(extracting | analyzing, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in extracting:
+                    extracting.remove(future)
+                    analyzing.add(analysis_pool.submit(analyze_report, future.result()))
+                else:
+                    analyzing.remove(future)
+                    yield future.result()
+
+
+def run_batch(reports, extract_workers=None, analysis_workers=DEFAULT_ANALYSIS_WORKERS, progress=None):
+    """Process a batch of reports, returning results in input order.
+
+    progress, if given, is called as progress(done, total, result) after each report.
+    """
+    reports = list(reports)
+    order = {name: i for i, (name, _) in enumerate(reports)}
+    results = []
+    for result in iter_batch_results(reports, extract_workers, analysis_workers):
+        results.append(result)
+        if progress is not None:
+            progress(len(results), len(reports), result)
+    return sorted(results, key=lambda result: order[result["filename"]])
@@ -0,0 +1,159 @@
+# Compare the single-pass parameter extractor with the original per-parameter
+# regexes, for accuracy and speed.
+#
+#   python -m benchmark_extraction                  # built-in sample layouts
+#   python -m benchmark_extraction --corpus samples/
+#
+# A corpus directory holds report text files (*.txt, pages separated by form
+# feeds) and an expected.json mapping each file name to its parameter values.
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from parameter_extractor import PARAMETERS, extract_parameter_details, parameter_values
+
+LEGACY_PATTERNS = {
+    'RBC': r'RBC[:\s]+(\d+\.?\d*)',
+    'HGB': r'HGB[:\s]+(\d+\.?\d*)',
+    'MCV': r'MCV[:\s]+(\d+\.?\d*)',
+    'MCH': r'MCH[:\s]+(\d+\.?\d*)',
+    'MCHC': r'MCHC[:\s]+(\d+\.?\d*)',
+    'RDW': r'RDW[:\s]+(\d+\.?\d*)',
+    'F_concentration': r'F[:\s]+(\d+\.?\d*)',
+    'A2_concentration': r'A2[:\s]+(\d+\.?\d*)',
+    'Ao_peak': r'Ao[\s\w]*Calibrated Area[:\s]+(\d+\.?\d*)',
+    'S_peak': r'S[\s\w]*Calibrated Area[:\s]+(\d+\.?\d*)'
+}
+
+
+def legacy_extract(pages):
+    """The extraction pdf_processor used before parameter_extractor"""
+    text = "\n".join(pages)
+    results = dict.fromkeys(PARAMETERS)
+    for param, pattern in LEGACY_PATTERNS.items():
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            results[param] = float(match.group(1))
+    return results
+
+
+def new_extract(pages):
+    return parameter_values(extract_parameter_details(pages))
+
+
+NORMAL = {'RBC': 4.8, 'HGB': 14.1, 'MCV': 88.2, 'MCH': 29.4, 'MCHC': 33.3, 'RDW': 12.9,
+          'F_concentration': 0.6, 'A2_concentration': 2.7, 'Ao_peak': 86.1, 'S_peak': 0.0}
+TRAIT = {'RBC': 5.9, 'HGB': 11.2, 'MCV': 64.5, 'MCH': 19.8, 'MCHC': 30.7, 'RDW': 15.1,
+         'F_concentration': 1.9, 'A2_concentration': 5.4, 'Ao_peak': 82.3, 'S_peak': 0.0}
+SICKLE = {'RBC': 4.6, 'HGB': 12.8, 'MCV': 84.0, 'MCH': 28.1, 'MCHC': 33.5, 'RDW': 13.8,
+          'F_concentration': 1.1, 'A2_concentration': 3.2, 'Ao_peak': 56.4, 'S_peak': 37.9}
+
+
+def _analyzer_layout(v):
+    # CBC block followed by an HPLC page, as the original regexes were written for
+    cbc = (f"Patient Name: Jane Doe   Sex: F   Age: 34\n"
+           f"RBC: {v['RBC']} x10^12/L\nHGB: {v['HGB']} g/dL\nMCV: {v['MCV']} fL\n"
+           f"MCH: {v['MCH']} pg\nMCHC: {v['MCHC']} g/dL\nRDW: {v['RDW']} %\n")
+    hplc = (f"Peak Name   Calibrated Area %\nF {v['F_concentration']}\nA2 {v['A2_concentration']}\n"
+            f"Ao Peak Calibrated Area {v['Ao_peak']}\nS Window Calibrated Area {v['S_peak']}\n")
+    return [cbc, hplc]
+
+
+def _table_layout(v):
+    # Parameter, value, unit and reference range on one line; HGB in g/L
+    return [(
+        "FULL BLOOD COUNT\nTest                 Result   Units        Reference\n"
+        f"Haemoglobin          {v['HGB'] * 10:g} g/L      120-160\n"
+        f"Red Cell Count       {v['RBC']} x10^12/L  4.0-5.5\n"
+        f"MCV                  {v['MCV']} fL        80-100\n"
+        f"MCHC                 {v['MCHC']} g/dL     32-36\n"
+        f"MCH                  {v['MCH']} pg        27-33\n"
+        f"RDW-CV               {v['RDW']} %         11.5-14.5\n"
+        "HAEMOGLOBIN ANALYSIS (HPLC)\n"
+        f"Hb A2                {v['A2_concentration']} %         2.0-3.5\n"
+        f"Hb F                 {v['F_concentration']} %         <1.0\n"
+        f"A0 Calibrated Area   {v['Ao_peak']} %\n"
+        f"S Calibrated Area    {v['S_peak']} %\n"
+    )]
+
+
+def _narrative_layout(v):
+    # Summary sentence pages and abbreviations with dotted labels
+    return [
+        (f"Sex: F\nR.B.C. = {v['RBC']} mill/cmm, Hb = {v['HGB']} g/dL, MCV = {v['MCV']} fL,\n"
+         f"MCH = {v['MCH']} pg, MCHC = {v['MCHC']} g/dL, RDW = {v['RDW']}%\n"),
+        (f"HbF Concentration: {v['F_concentration']}%\nHbA2 Concentration: {v['A2_concentration']}%\n"
+         f"Ao Peak: {v['Ao_peak']}%   S Peak: {v['S_peak']}%\n"
+         f"Interpretation: HbA2 {v['A2_concentration']} % reviewed by pathologist.\n"),
+    ]
+
+
+def sample_corpus():
+    """(name, pages, expected) reports covering several lab layouts"""
+    corpus = []
+    for layout in (_analyzer_layout, _table_layout, _narrative_layout):
+        for label, values in (("normal", NORMAL), ("beta_thal_trait", TRAIT), ("sickle_trait", SICKLE)):
+            corpus.append((f"{layout.__name__.strip('_')}/{label}", layout(values), values))
+    return corpus
+
+
+def load_corpus(directory):
+    with open(os.path.join(directory, "expected.json")) as f:
+        expected = json.load(f)
+    corpus = []
+    for name, values in sorted(expected.items()):
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            corpus.append((name, f.read().split("\f"), values))
+    return corpus
+
+
+def score(extract, corpus, repeat):
+    """Correct parameters per name, and mean microseconds per report"""
+    correct = dict.fromkeys(PARAMETERS, 0)
+    for _, pages, expected in corpus:
+        found = extract(pages)
+        for name in PARAMETERS:
+            if expected.get(name) is not None and found[name] is not None \
+                    and abs(found[name] - expected[name]) < 1e-6:
+                correct[name] += 1
+            elif expected.get(name) is None and found[name] is None:
+                correct[name] += 1
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _, pages, _ in corpus:
+            extract(pages)
+    elapsed = (time.perf_counter() - start) / (repeat * len(corpus))
+    return correct, elapsed * 1e6
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark parameter extraction accuracy and speed")
+    parser.add_argument('--corpus', help="Directory of report text files with expected.json (default: built-in samples)")
+    parser.add_argument('--repeat', type=int, default=200, help="Timing passes over the corpus (default: 200)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    corpus = load_corpus(args.corpus) if args.corpus else sample_corpus()
+    if not corpus:
+        print("Corpus is empty", file=sys.stderr)
+        return 2
+    results = {name: score(extract, corpus, args.repeat)
+               for name, extract in (("legacy", legacy_extract), ("single-pass", new_extract))}
+
+    print(f"{len(corpus)} reports\n")
+    print(f"{'Parameter':<18}" + "".join(f"{name:>14}" for name in results))
+    for parameter in PARAMETERS:
+        print(f"{parameter:<18}" + "".join(f"{correct[parameter]:>11}/{len(corpus):<2}"
+                                          for correct, _ in results.values()))
+    total = len(corpus) * len(PARAMETERS)
+    print(f"{'Accuracy':<18}" + "".join(f"{sum(correct.values()) / total:>14.1%}" for correct, _ in results.values()))
+    print(f"{'us per report':<18}" + "".join(f"{micros:>14.1f}" for _, micros in results.values()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with optional TTL and SQLite tier.
+
+    Entries are evicted least-recently-used first once ``maxsize`` is
+    reached, and expire ``ttl`` seconds after they were stored. When ``path``
+    is given, entries are also written to a SQLite table (namespaced so
+    several caches can share one file) and memory misses fall through to it,
+    so the cache survives process restarts. Values must be picklable for the
+    disk tier, and keys must be strings.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, path=None, namespace="default",
+                 max_disk_entries=100_000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.namespace = namespace
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._disk = None
+        self._disk_writes = 0
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path):
+        try:
+            self._disk = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=NORMAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+                " stored_at REAL NOT NULL, expires_at REAL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._prune_disk()
+        except Exception as e:
+            print(f"Warning: Could not open cache database '{path}': {str(e)}")
+            self._disk = None
+
+    def _expires_at(self, now):
+        return now + self.ttl if self.ttl else None
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            entry = self._disk_get(key, now)
+            if entry is not _MISSING:
+                value, stored_at = entry
+                self.hits += 1
+                self.disk_hits += 1
+                # Expires when the stored copy would, not a full TTL after promotion
+                self._store(key, value, self._expires_at(stored_at))
+                return value
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = self._expires_at(now)
+        with self._lock:
+            self._store(key, value, expires_at)
+            self._disk_set(key, value, now, expires_at)
+
+    def get_or_set(self, key, factory):
+        """Return the cached value for key, computing and storing it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+
+    def stats(self):
+        """Hit/miss counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key, now):
+        """(value, stored_at) of an unexpired row, or _MISSING"""
+        if self._disk is None:
+            return _MISSING
+        try:
+            row = self._disk.execute(
+                "SELECT value, expires_at, stored_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                return _MISSING
+            return pickle.loads(row[0]), row[2]
+        except Exception as e:
+            print(f"Warning: Cache database read failed: {str(e)}")
+            return _MISSING
+
+    def _disk_set(self, key, value, now, expires_at):
+        if self._disk is None:
+            return
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, stored_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, expires_at)
+            )
+            self._disk_writes += 1
+            if self._disk_writes % 256 == 0:
+                self._prune_disk()
+        except Exception as e:
+            print(f"Warning: Cache database write failed: {str(e)}")
+
+    def _prune_disk(self):
+        """Drop expired rows and keep at most max_disk_entries newest rows for this namespace"""
+        self._disk.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+            (self.namespace, time.time())
+        )
+        self._disk.execute(
+            "DELETE FROM cache_entries WHERE namespace = ? AND key NOT IN ("
+            " SELECT key FROM cache_entries WHERE namespace = ? ORDER BY stored_at DESC LIMIT ?)",
+            (self.namespace, self.namespace, self.max_disk_entries)
+        )
@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+# Binary chunk store layout (native little-endian):
+#   header     magic, version, chunk count, file count, section positions
+#   offsets    uint64[count + 1]  byte offsets of each chunk into the text blob
+#   file_ids   uint32[count]      index of each chunk's source file in the name table
+#                                 (NO_FILE for unused IDs, whose text is empty)
+#   locations  uint32[count, 4]   first page, last page (1-based, 0 if unknown),
+#                                 start and end character offset in the document
+#                                 (version 2 only)
+#   names      uint32[file_count + 1] offsets followed by the UTF-8 file names
+#   text       contiguous UTF-8 chunk text
+MAGIC = b"HBCHUNKS"
+VERSION = 2
+HEADERS = {
+    1: struct.Struct("<8sIIII4Q"),
+    2: struct.Struct("<8sIIII5Q"),
+}
+HEADER = HEADERS[VERSION]
+NO_FILE = 0xFFFFFFFF
+LOCATION_FIELDS = ("page_start", "page_end", "char_start", "char_end")
+
+
+def _align(position, alignment=8):
+    return (position + alignment - 1) // alignment * alignment
+
+
+def _atomic_write(path, parts):
+    """Write byte strings to path via a temporary file so readers never see a partial store"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for part in parts:
+            f.write(part)
+    os.replace(tmp_path, path)
+
+
+def write_chunk_store(chunks, path):
+    """Write an iterable of {"filename", "chunk"} dicts to a binary chunk store.
+
+    Chunk IDs are positions in the iterable; None entries leave an unused ID.
+    Page numbers and character offsets are stored when the chunks have them.
+    """
+    if sys.byteorder != "little":
+        raise RuntimeError("Chunk store files are little-endian only")
+
+    offsets = array('Q', [0])
+    file_ids = array('I')
+    locations = array('I')
+    names = {}
+    text_parts = []
+    text_size = 0
+    for chunk in chunks:
+        if chunk is None:
+            offsets.append(text_size)
+            file_ids.append(NO_FILE)
+            locations.extend((0, 0, 0, 0))
+            continue
+        data = chunk["chunk"].encode("utf-8")
+        text_parts.append(data)
+        text_size += len(data)
+        offsets.append(text_size)
+        file_ids.append(names.setdefault(chunk["filename"], len(names)))
+        locations.extend(chunk.get(field) or 0 for field in LOCATION_FIELDS)
+
+    encoded_names = [name.encode("utf-8") for name in names]
+    name_offsets = array('I', [0])
+    for name in encoded_names:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    count = len(file_ids)
+    offsets_pos = _align(HEADER.size)
+    file_ids_pos = _align(offsets_pos + offsets.itemsize * len(offsets))
+    locations_pos = _align(file_ids_pos + file_ids.itemsize * count)
+    names_pos = _align(locations_pos + locations.itemsize * len(locations))
+    text_pos = _align(names_pos + name_offsets.itemsize * len(name_offsets) + name_offsets[-1])
+
+    header = HEADER.pack(MAGIC, VERSION, count, len(names), 0,
+                         offsets_pos, file_ids_pos, names_pos, text_pos, locations_pos)
+
+    def padded(parts, start, end):
+        size = sum(len(part) for part in parts)
+        return parts + [b"\0" * (end - start - size)]
+
+    _atomic_write(path, (
+        padded([header], 0, offsets_pos)
+        + padded([offsets.tobytes()], offsets_pos, file_ids_pos)
+        + padded([file_ids.tobytes()], file_ids_pos, locations_pos)
+        + padded([locations.tobytes()], locations_pos, names_pos)
+        + padded([name_offsets.tobytes(), *encoded_names], names_pos, text_pos)
+        + text_parts
+    ))
+    return count
+
+
+def convert_json_chunks(json_path, store_path):
+    """Convert a chunks.json file produced by indexing.py into a binary chunk store"""
+    with open(json_path, 'r') as f:
+        chunks = json.load(f)
+    return write_chunk_store(chunks, store_path)
+
+
+class ChunkStore:
+    """Read-only, memory-mapped view over a binary chunk store.
+
+    Opening the store only parses the fixed-size header and the file name
+    table; chunk text is decoded on access, and the mapped pages are shared
+    between every process that opens the same file.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise RuntimeError("Chunk store files are little-endian only")
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        magic, version = struct.unpack_from("<8sI", self._mmap, 0)
+        if magic != MAGIC or version not in HEADERS:
+            self.close()
+            raise ValueError(f"Unsupported chunk store format in {path}")
+        (_, _, count, file_count, _, offsets_pos, file_ids_pos, names_pos, text_pos,
+         *locations_pos) = HEADERS[version].unpack_from(self._mmap, 0)
+
+        view = memoryview(self._mmap)
+        self._count = count
+        self._text_pos = text_pos
+        self._offsets = view[offsets_pos:offsets_pos + 8 * (count + 1)].cast('Q')
+        self._file_ids = view[file_ids_pos:file_ids_pos + 4 * count].cast('I')
+        self._locations = None
+        if locations_pos:
+            start = locations_pos[0]
+            self._locations = view[start:start + 16 * count].cast('I')
+
+        name_offsets = view[names_pos:names_pos + 4 * (file_count + 1)].cast('I')
+        names_start = names_pos + 4 * (file_count + 1)
+        self.filenames = [
+            bytes(view[names_start + name_offsets[i]:names_start + name_offsets[i + 1]]).decode("utf-8")
+            for i in range(file_count)
+        ]
+        name_offsets.release()
+        view.release()
+
+    def __len__(self):
+        return self._count
+
+    def _check_index(self, i):
+        if not 0 <= i < self._count:
+            raise IndexError(f"Chunk index {i} out of range")
+
+    def text(self, i):
+        """Return the text of chunk i"""
+        self._check_index(i)
+        start = self._text_pos + self._offsets[i]
+        end = self._text_pos + self._offsets[i + 1]
+        return self._mmap[start:end].decode("utf-8")
+
+    def filename(self, i):
+        """Return the source file name of chunk i, or None if the ID is unused"""
+        self._check_index(i)
+        file_id = self._file_ids[i]
+        return None if file_id == NO_FILE else self.filenames[file_id]
+
+    def location(self, i):
+        """Return page_start, page_end, char_start and char_end of chunk i (empty if not recorded)"""
+        self._check_index(i)
+        if self._locations is None or not self._locations[4 * i]:
+            return {}
+        return dict(zip(LOCATION_FIELDS, self._locations[4 * i:4 * i + 4]))
+
+    def __getitem__(self, i):
+        # Same shape as the entries written by indexing.py (None for unused IDs)
+        filename = self.filename(i)
+        if filename is None:
+            return None
+        return {"filename": filename, "chunk": self.text(i), **self.location(i)}
+
+    def close(self):
+        for name in ("_offsets", "_file_ids", "_locations"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python chunk_store.py <chunks.json> <chunks.bin>")
+        sys.exit(1)
+    count = convert_json_chunks(sys.argv[1], sys.argv[2])
+    print(f"Wrote {count} chunks to '{sys.argv[2]}'")
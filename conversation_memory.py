@@ -0,0 +1,131 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from embeddings import approximate_token_starts
+
+# Recent turns kept verbatim when older ones are folded into the summary
+KEEP_RECENT_TURNS = 2
+SUMMARY_MAX_CHARS = 1200
+
+
+def count_tokens(text):
+    return len(approximate_token_starts(text))
+
+
+class Conversation:
+    """Recent turns, a running summary and the chunks retrieved for the last answer"""
+
+    __slots__ = ("turns", "summary", "chunk_ref", "last_active")
+
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ""
+        self.chunk_ref = None
+        self.last_active = time.monotonic()
+
+    def add_turn(self, question, answer, chunk_ref=None):
+        self.turns.append((question, answer))
+        if chunk_ref is not None:
+            self.chunk_ref = chunk_ref
+
+    @property
+    def last_question(self):
+        return self.turns[-1][0] if self.turns else None
+
+    def tokens(self):
+        return count_tokens(self.summary) + sum(count_tokens(q) + count_tokens(a) for q, a in self.turns)
+
+    def messages(self):
+        """Chat messages replaying the summary and recent turns ahead of a new question"""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        for question, answer in self.turns:
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": answer})
+        return messages
+
+
+class ConversationStore:
+    """Per-sender conversations with a bounded memory footprint.
+
+    Each conversation keeps at most max_turns turns. Once it is full or over
+    token_budget, older turns are folded into a summary by
+    summarize(summary, turns). Conversations idle for idle_timeout seconds
+    are dropped, as are the least recently active ones beyond
+    max_conversations.
+    """
+
+    def __init__(self, summarize=None, max_turns=6, token_budget=1000, idle_timeout=1800,
+                 max_conversations=10_000):
+        self.summarize = summarize
+        self.max_turns = max(max_turns, KEEP_RECENT_TURNS + 1)
+        self.token_budget = token_budget
+        self.idle_timeout = idle_timeout
+        self.max_conversations = max_conversations
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self.summaries = 0
+        self.evictions = 0
+
+    def get(self, sender):
+        """Return the conversation for a sender, starting a new one if needed"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_sweep > 60:
+                self._evict_idle(now)
+            conversation = self._conversations.get(sender)
+            if conversation is None or now - conversation.last_active > self.idle_timeout:
+                conversation = Conversation(self.max_turns)
+                self._conversations[sender] = conversation
+            conversation.last_active = now
+            self._conversations.move_to_end(sender)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+                self.evictions += 1
+            return conversation
+
+    def _evict_idle(self, now):
+        self._last_sweep = now
+        # Ordered by last activity, so idle conversations are at the front
+        while self._conversations:
+            sender, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_active <= self.idle_timeout:
+                break
+            del self._conversations[sender]
+            self.evictions += 1
+
+    def compact(self, sender):
+        """Fold older turns into the summary once the conversation is full or over budget.
+
+        Called after the reply has been sent, so summarizing does not delay it.
+        """
+        with self._lock:
+            conversation = self._conversations.get(sender)
+        if conversation is None:
+            return
+        if len(conversation.turns) < self.max_turns and conversation.tokens() <= self.token_budget:
+            return
+
+        turns = list(conversation.turns)
+        older, recent = turns[:-KEEP_RECENT_TURNS], turns[-KEEP_RECENT_TURNS:]
+        if not older:
+            return
+        summary = conversation.summary
+        if self.summarize is not None:
+            try:
+                summary = self.summarize(summary, older)
+                self.summaries += 1
+            except Exception as e:
+                # The older turns are dropped either way, so memory stays bounded
+                print(f"Warning: Could not summarize conversation: {str(e)}")
+        conversation.summary = summary[:SUMMARY_MAX_CHARS]
+        conversation.turns = deque(recent, maxlen=self.max_turns)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._conversations)
+
+    def stats(self):
+        return {"conversations": len(self), "summaries": self.summaries, "evictions": self.evictions}
@@ -0,0 +1,90 @@
+import re
+import hashlib
+import numpy as np
+
+# 64-bit SimHash over word shingles: texts that differ only in a few words
+# (re-exported PDFs, copies with different whitespace or headers) get
+# fingerprints within a small Hamming distance of each other.
+FINGERPRINT_BITS = 64
+DEFAULT_MAX_DISTANCE = 3
+_BANDS = 4
+_BAND_BITS = FINGERPRINT_BITS // _BANDS
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def _shingles(text, size):
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return [" ".join(words)] if words else []
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+_BIT_POSITIONS = np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+
+
+def simhash(text, shingle_size=3):
+    """64-bit SimHash fingerprint of a text"""
+    shingles = _shingles(text, shingle_size)
+    if not shingles:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles)
+    )
+    # Each bit is set when most shingle hashes have it set
+    votes = ((hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)).sum(axis=0)
+    bits = votes * 2 > len(shingles)
+    return int(np.packbits(bits, bitorder="little").view("<u8")[0])
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class NearDuplicateIndex:
+    """Finds previously added fingerprints within max_distance bits.
+
+    Fingerprints are bucketed by four 16-bit bands; two fingerprints at
+    distance <= 3 must agree exactly on at least one band, so only those
+    buckets are compared.
+    """
+
+    def __init__(self, max_distance=DEFAULT_MAX_DISTANCE):
+        if max_distance >= _BANDS:
+            raise ValueError(f"max_distance must be below {_BANDS} for banded lookup")
+        self.max_distance = max_distance
+        self._buckets = [{} for _ in range(_BANDS)]
+
+    def _bands(self, fingerprint):
+        mask = (1 << _BAND_BITS) - 1
+        return [(fingerprint >> (band * _BAND_BITS)) & mask for band in range(_BANDS)]
+
+    def find(self, fingerprint):
+        """Return the item ID of a near-duplicate, or None"""
+        for band, key in enumerate(self._bands(fingerprint)):
+            for other, item_id in self._buckets[band].get(key, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance:
+                    return item_id
+        return None
+
+    def add(self, fingerprint, item_id):
+        for band, key in enumerate(self._bands(fingerprint)):
+            self._buckets[band].setdefault(key, []).append((fingerprint, item_id))
+
+
+def select_distinct(ids, get_text, k, max_distance=DEFAULT_MAX_DISTANCE):
+    """Return the first k IDs (in rank order) whose texts are non-empty and not near-duplicates"""
+    seen = NearDuplicateIndex(max_distance)
+    selected = []
+    for item_id in ids:
+        text = get_text(item_id)
+        if not text:
+            continue
+        fingerprint = simhash(text)
+        if seen.find(fingerprint) is not None:
+            continue
+        seen.add(fingerprint, item_id)
+        selected.append(item_id)
+        if len(selected) == k:
+            break
+    return selected
@@ -0,0 +1,213 @@
+import os
+import re
+import importlib.util
+import json
+import threading
+import numpy as np
+
+DEFAULT_BACKEND = "sentence-transformers"
+DEFAULT_MODELS = {
+    "sentence-transformers": "sentence-transformers/all-mpnet-base-v2",
+    "openai": "text-embedding-ada-002",
+}
+# Dimensions of models we know without loading them
+KNOWN_DIMENSIONS = {
+    "sentence-transformers/all-mpnet-base-v2": 768,
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+
+# Rough stand-in for a subword tokenizer: words and punctuation marks
+_APPROXIMATE_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def approximate_token_starts(text):
+    """Start offsets of words and punctuation marks, approximating subword tokens"""
+    return [match.start() for match in _APPROXIMATE_TOKEN.finditer(text)]
+
+
+class IndexMetadataError(ValueError):
+    """Raised when an index does not match the embedding model recorded for it"""
+
+
+class EmbeddingBackend:
+    """Turns text into float32 vectors for FAISS indexing and querying"""
+
+    name = None
+
+    def __init__(self, model):
+        self.model = model
+
+    @property
+    def key(self):
+        """Identifier of the vector space this backend produces"""
+        return f"{self.name}:{self.model}"
+
+    @property
+    def dimension(self):
+        return KNOWN_DIMENSIONS.get(self.model) or len(self.embed_query("dimension probe"))
+
+    def embed(self, texts):
+        """Embed a list of texts, returning a (len(texts), dimension) float32 array"""
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        """Embed a single query, returning a (dimension,) float32 array"""
+        return self.embed([text])[0]
+
+    def token_starts(self, text):
+        """Character offsets at which the model's tokens start, in order.
+
+        Used to size chunks in tokens; the default approximates tokens as
+        words and punctuation marks.
+        """
+        return approximate_token_starts(text)
+
+    def metadata(self):
+        return {"backend": self.name, "model": self.model, "dimension": self.dimension}
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """Local CPU embeddings using sentence-transformers (the model indexing.py builds with)"""
+
+    name = "sentence-transformers"
+
+    def __init__(self, model=DEFAULT_MODELS["sentence-transformers"], batch_size=32, device="cpu"):
+        super().__init__(model)
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Imported lazily: torch is slow to import and only needed here
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model, device=self.device)
+                    print(f"Loaded embedding model {self.model}")
+        return self._model
+
+    @property
+    def dimension(self):
+        return KNOWN_DIMENSIONS.get(self.model) or self._load().get_sentence_embedding_dimension()
+
+    @property
+    def max_tokens(self):
+        """Tokens the model reads per input; longer inputs are truncated"""
+        return self._load().max_seq_length
+
+    def token_starts(self, text):
+        # One tokenizer pass over the whole text; offsets map tokens back to characters
+        encoding = self._load().tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+        )
+        return [start for start, _ in encoding["offset_mapping"]]
+
+    def embed(self, texts):
+        embeddings = self._load().encode(
+            list(texts),
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return np.asarray(embeddings, dtype='float32')
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    """Remote embeddings from the OpenAI API"""
+
+    name = "openai"
+
+    def __init__(self, model=DEFAULT_MODELS["openai"], batch_size=512):
+        super().__init__(model)
+        self.batch_size = batch_size
+
+    def embed(self, texts):
+        # Shares the app's pooled client, retries and rate limit
+        from llm_gateway import create_embeddings
+        texts = list(texts)
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(create_embeddings(texts[start:start + self.batch_size], self.model))
+        return np.array(embeddings, dtype='float32')
+
+
+BACKENDS = {
+    SentenceTransformerBackend.name: SentenceTransformerBackend,
+    OpenAIEmbeddingBackend.name: OpenAIEmbeddingBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_embedding_backend(backend=None, model=None):
+    """Return the process-wide backend instance for a backend/model pair.
+
+    Defaults come from the EMBEDDING_BACKEND and EMBEDDING_MODEL environment
+    variables, falling back to the local sentence-transformers model, or to
+    OpenAI when sentence-transformers is not installed. A backend passed
+    explicitly (as recorded in index metadata) is never substituted.
+    """
+    if backend is None:
+        backend = os.getenv("EMBEDDING_BACKEND", DEFAULT_BACKEND)
+        if backend == SentenceTransformerBackend.name and importlib.util.find_spec("sentence_transformers") is None:
+            # EMBEDDING_MODEL names a sentence-transformers model here, so use the OpenAI default
+            backend, model = OpenAIEmbeddingBackend.name, model or DEFAULT_MODELS[OpenAIEmbeddingBackend.name]
+            if (backend, model) not in _backends:
+                print(f"Warning: sentence-transformers is not installed; using the OpenAI embedding backend ({model}) instead")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Choose from: {', '.join(BACKENDS)}")
+    model = model or os.getenv("EMBEDDING_MODEL") or DEFAULT_MODELS[backend]
+    with _backends_lock:
+        if (backend, model) not in _backends:
+            _backends[(backend, model)] = BACKENDS[backend](model)
+        return _backends[(backend, model)]
+
+
+def metadata_path(index_path):
+    """Path of the metadata file stored next to a FAISS index"""
+    return os.path.splitext(index_path)[0] + ".meta.json"
+
+
+def write_index_metadata(index_path, backend, index, **extra):
+    """Record which embedding model and dimension an index was built with"""
+    metadata = backend.metadata()
+    metadata.update({"dimension": index.d, "count": index.ntotal}, **extra)
+    path = metadata_path(index_path)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp_path, path)
+    return metadata
+
+
+def read_index_metadata(index_path):
+    """Read the metadata written by write_index_metadata"""
+    path = metadata_path(index_path)
+    if not os.path.exists(path):
+        raise IndexMetadataError(
+            f"No metadata file '{path}' for index '{index_path}'. Rebuild the index with indexing.py."
+        )
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def backend_for_index(index_path, index, metadata=None):
+    """Return the embedding backend an index was built with, checking dimensions agree"""
+    metadata = metadata or read_index_metadata(index_path)
+    backend = get_embedding_backend(metadata["backend"], metadata["model"])
+    if metadata["dimension"] != index.d:
+        raise IndexMetadataError(
+            f"Index '{index_path}' has dimension {index.d} but its metadata records {metadata['dimension']}"
+        )
+    if backend.dimension != index.d:
+        raise IndexMetadataError(
+            f"Embedding model {metadata['model']} produces {backend.dimension}-d vectors "
+            f"but index '{index_path}' is {index.d}-d"
+        )
+    return backend
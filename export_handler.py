@@ -3,6 +3,7 @@ import plotly
 import json
 from datetime import datetime
 import io
+from patient_repository import repository, PARAMETERS
 
 def export_to_csv(parameters, assessment, pathologist_notes=None):
     """Export analysis results to CSV format"""
@@ -47,6 +48,109 @@ def export_to_json(parameters, assessment, charts=None, pathologist_notes=None):
     except Exception as e:
         raise Exception(f"Error exporting to JSON: {str(e)}")
 
+def _batch_rows(results):
+    """One flat row per report: file, parameters, assessment and any error"""
+    rows = []
+    for result in results:
+        assessment = result.get('assessment') or {}
+        row = {'filename': result['filename'], 'status': result.get('status', '')}
+        row.update(result.get('parameters') or {})
+        row['system_assessment'] = assessment.get('system_assessment', '')
+        row['analysis_path'] = assessment.get('analysis_path', '')
+        row['error'] = result.get('error') or ''
+        rows.append(row)
+    return rows
+
+def export_batch_to_csv(results):
+    """Export the results of a batch analysis to a single CSV"""
+    try:
+        df = pd.DataFrame(_batch_rows(results))
+        df['analysis_date'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        csv_buffer = io.StringIO()
+        df.to_csv(csv_buffer, index=False)
+        return csv_buffer.getvalue()
+    except Exception as e:
+        raise Exception(f"Error exporting batch to CSV: {str(e)}")
+
+def export_batch_to_json(results):
+    """Export the results of a batch analysis to a single JSON document"""
+    try:
+        export_data = {
+            'analysis_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'report_count': len(results),
+            'reports': [
+                {
+                    'filename': result['filename'],
+                    'status': result.get('status'),
+                    'parameters': result.get('parameters'),
+                    'assessment': result.get('assessment'),
+                    'error': result.get('error')
+                }
+                for result in results
+            ]
+        }
+        return json.dumps(export_data, indent=2)
+    except Exception as e:
+        raise Exception(f"Error exporting batch to JSON: {str(e)}")
+
+def export_batch_to_jsonl(results):
+    """Yield one JSON Lines record per batch analysis result, as results arrive"""
+    for result in results:
+        try:
+            yield json.dumps({
+                'filename': result['filename'],
+                'status': result.get('status'),
+                'parameters': result.get('parameters'),
+                'assessment': result.get('assessment'),
+                'error': result.get('error'),
+                'analysis_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }) + "\n"
+        except Exception as e:
+            raise Exception(f"Error exporting to JSON Lines: {str(e)}")
+
+def _report_rows(reports):
+    """One flat row per stored report: date, file, parameters, latest assessment and notes"""
+    rows = []
+    for report in reports:
+        assessment = report['assessment'] or {}
+        row = {'report_date': report['report_date'], 'patient_number': report['patient_number'],
+               'filename': report['filename']}
+        row.update(report['parameters'])
+        row['system_assessment'] = assessment.get('system_assessment', '')
+        row['analysis_path'] = assessment.get('analysis_path', '')
+        row['pathologist_notes'] = "\n".join(note['note'] for note in report['pathologist_notes'])
+        rows.append(row)
+    return rows
+
+def export_patient_reports_to_csv(patient_number, start=None, end=None):
+    """Export a patient's stored reports (optionally within a date range) to CSV, newest first"""
+    try:
+        reports = repository.list_reports(patient_number, start=start, end=end)
+        columns = ['report_date', 'patient_number', 'filename', *PARAMETERS,
+                   'system_assessment', 'analysis_path', 'pathologist_notes']
+        df = pd.DataFrame(_report_rows(reports), columns=columns)
+
+        csv_buffer = io.StringIO()
+        df.to_csv(csv_buffer, index=False)
+        return csv_buffer.getvalue()
+    except Exception as e:
+        raise Exception(f"Error exporting patient reports to CSV: {str(e)}")
+
+def export_patient_reports_to_json(patient_number, start=None, end=None):
+    """Export a patient's stored reports (optionally within a date range) to JSON, newest first"""
+    try:
+        reports = repository.list_reports(patient_number, start=start, end=end)
+        export_data = {
+            'patient_number': patient_number,
+            'export_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'report_count': len(reports),
+            'reports': reports
+        }
+        return json.dumps(export_data, indent=2)
+    except Exception as e:
+        raise Exception(f"Error exporting patient reports to JSON: {str(e)}")
+
 def get_html_template():
     """Return HTML template for report"""
     return """
@@ -0,0 +1,133 @@
+import threading
+import numpy as np
+import pandas as pd
+from patient_repository import PARAMETERS, repository
+
+# Column-oriented copy of every patient's parameter history for the Medical
+# History charts. Rows are kept sorted by (patient, date), so a patient's
+# results are one contiguous slice and a date range within it is found by
+# binary search instead of scanning or querying every report.
+DEFAULT_MAX_POINTS = 500
+
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points Largest-Triangle-Three-Buckets keeps when reducing a series to threshold points"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    selected = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, n)
+        # The point forming the largest triangle with the last kept point and the next bucket's average
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[selected] - avg_x) * (y[start:end] - y[selected])
+                       - (x[selected] - x[start:end]) * (avg_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    return indices
+
+
+def downsample(history_data, parameters, max_points=DEFAULT_MAX_POINTS):
+    """Reduce a history DataFrame to at most max_points rows per parameter, keeping each parameter's shape.
+
+    Rows kept for any parameter are kept whole, so with several parameters
+    the result can have more than max_points rows; chart one parameter per
+    call for an exact bound.
+    """
+    if len(history_data) <= max_points:
+        return history_data
+    x = history_data['date'].to_numpy(dtype='datetime64[s]').astype(np.float64)
+    keep = np.zeros(len(history_data), dtype=bool)
+    for parameter in parameters:
+        y = history_data[parameter].to_numpy(dtype=np.float64)
+        present = np.flatnonzero(~np.isnan(y))
+        keep[present[lttb_indices(x[present], y[present], max_points)]] = True
+    return history_data[keep].reset_index(drop=True)
+
+
+class ParameterHistory:
+    """In-memory columnar table of parameter results, loaded incrementally from the patient repository"""
+
+    def __init__(self, repository):
+        self.repository = repository
+        self._lock = threading.Lock()
+        self._last_revision = 0
+        self._codes = {}
+        self._report_ids = np.empty(0, dtype=np.int64)
+        self._patients = np.empty(0, dtype=np.int32)
+        self._dates = np.empty(0, dtype='datetime64[s]')
+        self._values = np.empty((0, len(PARAMETERS)), dtype=np.float64)
+        self._slices = {}
+
+    def refresh(self):
+        """Load reports stored or corrected since the last refresh (by this or another process)"""
+        with self._lock:
+            rows = self.repository.parameter_rows(self._last_revision)
+            if not rows:
+                return 0
+            reports = {}
+            column = {name: i for i, name in enumerate(PARAMETERS)}
+            for revision, report_id, patient_number, report_date, parameter, value in rows:
+                if report_id not in reports:
+                    code = self._codes.setdefault(patient_number, len(self._codes))
+                    reports[report_id] = (code, report_date, np.full(len(PARAMETERS), np.nan))
+                if value is not None and parameter in column:
+                    reports[report_id][2][column[parameter]] = value
+                self._last_revision = max(self._last_revision, revision)
+
+            # Corrected reports replace their earlier rows
+            ids = np.fromiter(reports, dtype=np.int64, count=len(reports))
+            kept = ~np.isin(self._report_ids, ids)
+            report_ids = np.concatenate([self._report_ids[kept], ids])
+            patients = np.concatenate([self._patients[kept], np.array([r[0] for r in reports.values()], dtype=np.int32)])
+            dates = np.concatenate([self._dates[kept], np.array([r[1] for r in reports.values()], dtype='datetime64[s]')])
+            values = np.vstack([self._values[kept], np.array([r[2] for r in reports.values()])])
+            order = np.lexsort((dates, patients))
+            self._report_ids, self._patients, self._dates, self._values = (
+                report_ids[order], patients[order], dates[order], values[order]
+            )
+            codes, starts, counts = np.unique(self._patients, return_index=True, return_counts=True)
+            self._slices = {int(code): (int(start), int(start + count))
+                            for code, start, count in zip(codes, starts, counts)}
+            return len(reports)
+
+    def query(self, patient_number, start=None, end=None, parameters=PARAMETERS, max_points=None):
+        """A patient's results as a DataFrame with a 'date' column and one column per parameter.
+
+        start and end (datetimes or date strings, inclusive) limit the date
+        range; max_points downsamples long series for plotting.
+        """
+        self.refresh()
+        with self._lock:
+            base, stop = self._slices.get(self._codes.get(patient_number), (0, 0))
+            dates = self._dates[base:stop]
+            first, last = 0, len(dates)
+            if start is not None:
+                first = int(np.searchsorted(dates, np.datetime64(pd.Timestamp(start), 's'), side='left'))
+            if end is not None:
+                end = pd.Timestamp(end)
+                if end == end.normalize():
+                    # A date without a time includes that whole day
+                    end += pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+                last = int(np.searchsorted(dates, np.datetime64(end, 's'), side='right'))
+            rows = slice(base + first, base + max(first, last))
+            columns = [PARAMETERS.index(name) for name in parameters]
+            history_data = pd.DataFrame(self._values[rows][:, columns], columns=list(parameters))
+            history_data.insert(0, 'date', pd.to_datetime(self._dates[rows]))
+        if max_points:
+            history_data = downsample(history_data, parameters, max_points)
+        return history_data
+
+    def patients(self):
+        self.refresh()
+        with self._lock:
+            return [number for number, code in self._codes.items() if code in self._slices]
+
+
+# Shared by every session of the app
+history_store = ParameterHistory(repository)
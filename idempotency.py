@@ -0,0 +1,97 @@
+import time
+import sqlite3
+import threading
+from collections import deque
+
+
+class RecentKeyStore:
+    """Remembers keys seen in the last `window` seconds, for dropping repeated deliveries.
+
+    Keys are held in a bounded in-memory ring (oldest dropped first once
+    `capacity` is reached). When `path` is given they are also recorded in a
+    SQLite table, so repeats are still recognised after a restart or when
+    several processes share the file.
+    """
+
+    def __init__(self, window=3600, capacity=10_000, path=None):
+        self.window = window
+        self.capacity = capacity
+        self._ring = deque()
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self._disk = None
+        self._disk_writes = 0
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path):
+        try:
+            self._disk = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("PRAGMA synchronous=NORMAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS seen_keys (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+        except Exception as e:
+            print(f"Warning: Could not open idempotency database '{path}': {str(e)}")
+            self._disk = None
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        while self._ring and (self._ring[0][0] <= cutoff or len(self._ring) > self.capacity):
+            seen_at, key = self._ring.popleft()
+            if self._seen.get(key) == seen_at:
+                del self._seen[key]
+
+    def _disk_add(self, key, now):
+        """Record key in the database, returning False if it was already there within the window"""
+        cursor = self._disk.execute(
+            "INSERT INTO seen_keys (key, seen_at) VALUES (?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET seen_at = excluded.seen_at"
+            " WHERE seen_keys.seen_at <= ?",
+            (key, now, now - self.window)
+        )
+        self._disk_writes += 1
+        if self._disk_writes % 256 == 0:
+            self._disk.execute("DELETE FROM seen_keys WHERE seen_at <= ?", (now - self.window,))
+        return cursor.rowcount == 1
+
+    def add(self, key):
+        """Record key, returning False if it was already seen within the window"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if key in self._seen:
+                self.duplicates += 1
+                return False
+            if self._disk is not None:
+                try:
+                    if not self._disk_add(key, now):
+                        self.duplicates += 1
+                        return False
+                except Exception as e:
+                    print(f"Warning: Idempotency database error: {str(e)}")
+            self._seen[key] = now
+            self._ring.append((now, key))
+            self._expire(now)
+            return True
+
+    def discard(self, key):
+        """Forget key, so a later delivery of it is processed"""
+        with self._lock:
+            self._seen.pop(key, None)
+            if self._disk is not None:
+                try:
+                    self._disk.execute("DELETE FROM seen_keys WHERE key = ?", (key,))
+                except Exception as e:
+                    print(f"Warning: Idempotency database error: {str(e)}")
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(time.time())
+            return key in self._seen
+
+    def __len__(self):
+        with self._lock:
+            return len(self._seen)
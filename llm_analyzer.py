@@ -1,18 +1,74 @@
 import os
-from openai import OpenAI
+import threading
+from cache import LRUCache
+from llm_gateway import chat_completion
+from rules_classifier import classify_parameters, format_assessment
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
-try:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-except Exception as e:
-    raise Exception(f"Failed to initialize OpenAI client: {str(e)}")
+MODEL = "gpt-4o"
+# Bump when the prompt changes so assessments made with the old one are not reused
+PROMPT_VERSION = 1
+
+# LLM assessments keyed by the rounded parameter set, so repeat analyses are free
+# (optionally persisted via ANALYSIS_CACHE_PATH)
+assessment_cache = LRUCache(
+    int(os.getenv("ANALYSIS_CACHE_SIZE", "512")),
+    float(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 60 * 60))),
+    os.getenv("ANALYSIS_CACHE_PATH"),
+    "assessments"
+)
+PARAMETER_NAMES = ('RBC', 'HGB', 'MCV', 'MCH', 'MCHC', 'RDW',
+                   'F_concentration', 'A2_concentration', 'Ao_peak', 'S_peak')
+
+# How many analyses were settled by the rules engine, served from the cache or sent to the LLM
+analysis_counts = {"rules": 0, "cached": 0, "llm": 0}
+_counts_lock = threading.Lock()
+
+def _count(path):
+    with _counts_lock:
+        analysis_counts[path] += 1
+
+def get_analysis_stats():
+    """Analyses per path, the share handled by the rules engine and assessment cache statistics"""
+    with _counts_lock:
+        total = sum(analysis_counts.values())
+        stats = {**analysis_counts, "offload_rate": analysis_counts["rules"] / total if total else 0.0}
+    stats["cache"] = assessment_cache.stats()
+    return stats
+
+def assessment_cache_key(parameters):
+    """Canonical key for a parameter set: fixed order, values rounded to two decimals"""
+    values = []
+    for name in PARAMETER_NAMES:
+        value = parameters.get(name)
+        values.append("-" if value is None else f"{round(float(value), 2) + 0.0:.2f}")
+    return f"{MODEL}:p{PROMPT_VERSION}:" + "|".join(values)
 
 def analyze_results(parameters):
     """
     Analyze blood test results and provide assessment for potential hemoglobinopathies.
     """
     try:
+        # Clear-cut cases are classified locally; only the rest go to the LLM
+        rule = classify_parameters(parameters)
+        if rule is not None:
+            category, criteria = rule
+            _count("rules")
+            print(f"Analysis classified by rules as {category}")
+            return {
+                "system_assessment": format_assessment(parameters, category, criteria),
+                "analysis_path": "rules",
+                "classification": category
+            }
+
+        key = assessment_cache_key(parameters)
+        cached = assessment_cache.get(key)
+        if cached is not None:
+            _count("cached")
+            print("Analysis served from the assessment cache")
+            return {**cached, "cached": True}
+
         # Prepare the prompt with medical parameters
         prompt = f"""
         Analyze the following blood test results and provide an assessment for potential hemoglobinopathies:
@@ -39,8 +95,8 @@ def analyze_results(parameters):
         Provide detailed reasoning for the classification.
         """
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = chat_completion(
+            model=MODEL,
             messages=[
                 {"role": "system", "content": "You are a medical expert specializing in hemoglobinopathy analysis."},
                 {"role": "user", "content": prompt}
@@ -48,12 +104,16 @@ def analyze_results(parameters):
             temperature=0.2
         )
 
-        return {
-            "system_assessment": response.choices[0].message.content
+        _count("llm")
+        assessment = {
+            "system_assessment": response.choices[0].message.content,
+            "analysis_path": "llm"
         }
+        assessment_cache.set(key, assessment)
+        return dict(assessment)
     except Exception as e:
         print(f"Error in analyze_results: {str(e)}")
         raise Exception(f"Error in LLM analysis: {str(e)}")
 
 # Export the function
-__all__ = ['analyze_results']
\ No newline at end of file
+__all__ = ['analyze_results', 'get_analysis_stats']
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import time
+import random
+import threading
+from openai import (
+    OpenAI, DefaultHttpxClient,
+    APIStatusError, APITimeoutError, APIConnectionError,
+)
+from rate_limit import TokenBucket
+
+# Shared entry point for every OpenAI call in the app. All calls go through
+# one pooled HTTP client, with per-call timeouts, exponential backoff on
+# 429/5xx and connection errors, a cap on concurrent requests and a
+# process-wide request rate limit.
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+REQUESTS_PER_SECOND = float(os.getenv("LLM_REQUESTS_PER_SECOND", "10"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+_rate_limiter = TokenBucket(REQUESTS_PER_SECOND)
+_semaphore = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide synchronous OpenAI client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    http_client=DefaultHttpxClient(timeout=DEFAULT_TIMEOUT),
+                    max_retries=0,  # Retried here, so backoff and rate limiting see every attempt
+                )
+    return _client
+
+
+def is_retryable(error):
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt, error=None):
+    """Seconds to wait before retry number attempt, honouring a Retry-After header"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def call_with_retries(fn, timeout=None, **kwargs):
+    """Call an OpenAI client method with rate limiting, a concurrency cap and retries"""
+    timeout = timeout or DEFAULT_TIMEOUT
+    for attempt in range(MAX_RETRIES + 1):
+        _rate_limiter.acquire()
+        with _semaphore:
+            try:
+                return fn(timeout=timeout, **kwargs)
+            except Exception as e:
+                if attempt == MAX_RETRIES or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt, e)
+                print(f"Retrying OpenAI request in {delay:.1f}s after error: {str(e)}")
+        time.sleep(delay)
+
+
+def chat_completion(messages, model="gpt-4o", timeout=None, **kwargs):
+    """Create a chat completion"""
+    return call_with_retries(get_client().chat.completions.create, timeout,
+                             model=model, messages=messages, **kwargs)
+
+
+def create_embeddings(texts, model, timeout=None):
+    """Embed a list of texts, returning one vector per text"""
+    response = call_with_retries(get_client().embeddings.create, timeout, model=model, input=texts)
+    return [item.embedding for item in response.data]
+
+
+def stream_chat_completion(messages, model="gpt-4o", timeout=None, **kwargs):
+    """Yield the text of a chat completion as it is generated.
+
+    Opening the stream is retried like any other call; errors after text has
+    been yielded propagate, so callers never receive a repeated answer.
+    """
+    stream = call_with_retries(get_client().chat.completions.create, timeout,
+                               model=model, messages=messages, stream=True, **kwargs)
+    # Hold a concurrency slot until the stream is exhausted or the caller stops reading
+    with _semaphore, stream:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -4,9 +4,12 @@ import plotly.express as px
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from history_store import history_store, downsample
 
 def create_parameter_trend_chart(history_data, parameter):
     """Create an interactive line chart for a specific parameter over time"""
+    # Long histories are reduced to the points that preserve the trend's shape
+    history_data = downsample(history_data.dropna(subset=[parameter]), [parameter])
     fig = px.line(
         history_data,
         x='date',
@@ -26,10 +29,11 @@ def create_multi_parameter_chart(history_data, parameters):
     fig = go.Figure()
 
     for param in parameters:
+        series = downsample(history_data.dropna(subset=[param]), [param])
         fig.add_trace(
             go.Scatter(
-                x=history_data['date'],
-                y=history_data[param],
+                x=series['date'],
+                y=series[param],
                 name=param,
                 mode='lines+markers'
             )
@@ -107,13 +111,37 @@ def get_reference_ranges():
         'upper': [5.5, 16.0, 100.0, 32.0, 36.0, 14.5]
     }
 
+def load_patient_history():
+    """Let the user pick a patient and date range, and return that part of their history"""
+    patients = history_store.patients()
+    if not patients:
+        st.info("No patient results stored yet. Showing sample data for demonstration.")
+        return generate_sample_data()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        patient_number = st.selectbox("Patient", patients)
+    with col2:
+        date_range = st.date_input("Date range", value=(), help="Leave empty to show all results")
+    # Empty until a start date is picked, then (start,) until an end date is picked too
+    start = date_range[0] if len(date_range) > 0 else None
+    end = date_range[1] if len(date_range) > 1 else None
+
+    history_data = history_store.query(
+        patient_number, start, end,
+        parameters=['RBC', 'HGB', 'MCV', 'MCH', 'MCHC', 'RDW']
+    )
+    if history_data.empty:
+        st.warning("No results for this patient in the selected date range.")
+        return None
+    return history_data
+
 def show_medical_history_visualization():
     """Main function to display medical history visualization"""
     try:
         st.header("Medical History Visualization")
 
-        # Generate sample data (replace with actual data when available)
-        history_data = generate_sample_data()
+        history_data = load_patient_history()
 
         if history_data is not None:
             # Parameter selection
@@ -149,7 +177,5 @@ def show_medical_history_visualization():
             reference_ranges = get_reference_ranges()
             radar_chart = create_radar_chart(latest_data, reference_ranges)
             st.plotly_chart(radar_chart, use_container_width=True)
-        else:
-            st.warning("Unable to load medical history data. Please try again later.")
     except Exception as e:
         st.error(f"Error displaying medical history visualization: {str(e)}")
\ No newline at end of file
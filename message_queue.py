@@ -0,0 +1,187 @@
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import deque
+
+
+def shard_for(key, shards):
+    """Stable shard number for a key, so all work for one key runs on one worker"""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+class MemoryJobBackend:
+    """In-process job storage; pending jobs are lost when the process exits"""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self._queues = [deque() for _ in range(shards)]
+        self._conditions = [threading.Condition() for _ in range(shards)]
+        self._next_id = 0
+        self._id_lock = threading.Lock()
+
+    def put(self, shard, payload, key=""):
+        with self._id_lock:
+            self._next_id += 1
+            job_id = self._next_id
+        with self._conditions[shard]:
+            self._queues[shard].append((job_id, payload))
+            self._conditions[shard].notify()
+        return job_id
+
+    def get(self, shard, timeout=None):
+        """Return the oldest unacknowledged (job_id, payload) of a shard, or None on timeout"""
+        with self._conditions[shard]:
+            if not self._queues[shard]:
+                self._conditions[shard].wait(timeout)
+            return self._queues[shard][0] if self._queues[shard] else None
+
+    def ack(self, shard, job_id):
+        with self._conditions[shard]:
+            if self._queues[shard] and self._queues[shard][0][0] == job_id:
+                self._queues[shard].popleft()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues)
+
+
+class SQLiteJobBackend:
+    """Durable job storage: jobs stay in the database until acknowledged,
+    so messages accepted before a crash or restart are processed on startup.
+    Payloads must be JSON-serializable.
+    """
+
+    def __init__(self, shards, path):
+        self.shards = shards
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS queued_jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, shard INTEGER NOT NULL,"
+            " payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS queued_jobs_shard ON queued_jobs (shard, id)")
+        self._lock = threading.Lock()
+        self._conditions = [threading.Condition() for _ in range(shards)]
+        # The shard count may have changed since the jobs were queued
+        with self._lock:
+            for job_id, key in self._db.execute("SELECT id, key FROM queued_jobs").fetchall():
+                self._db.execute("UPDATE queued_jobs SET shard = ? WHERE id = ?",
+                                 (shard_for(key, shards), job_id))
+
+    def put(self, shard, payload, key=""):
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO queued_jobs (key, shard, payload, created_at) VALUES (?, ?, ?, ?)",
+                (key, shard, json.dumps(payload), time.time())
+            )
+        with self._conditions[shard]:
+            self._conditions[shard].notify()
+        return cursor.lastrowid
+
+    def _oldest(self, shard):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, payload FROM queued_jobs WHERE shard = ? ORDER BY id LIMIT 1", (shard,)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def get(self, shard, timeout=None):
+        # Checked under the condition so a put between the check and the wait is not missed
+        with self._conditions[shard]:
+            job = self._oldest(shard)
+            if job is None:
+                self._conditions[shard].wait(timeout)
+                job = self._oldest(shard)
+        return job
+
+    def ack(self, shard, job_id):
+        with self._lock:
+            self._db.execute("DELETE FROM queued_jobs WHERE id = ?", (job_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM queued_jobs").fetchone()[0]
+
+
+class ShardedWorkerPool:
+    """Runs handler(payload) on background threads, one thread per shard.
+
+    Jobs submitted with the same key always land on the same shard and are
+    handled one at a time in submission order, while different keys are
+    processed in parallel. At most max_depth jobs may be waiting; submit
+    blocks for up to block_timeout seconds for space and then rejects the job.
+    """
+
+    def __init__(self, handler, workers=4, max_depth=100, path=None, block_timeout=1.0):
+        self.handler = handler
+        self.workers = workers
+        self.block_timeout = block_timeout
+        self.backend = SQLiteJobBackend(workers, path) if path else MemoryJobBackend(workers)
+        # Jobs recovered from the database count towards the queue depth
+        self._recovered = len(self.backend)
+        self._slots = threading.Semaphore(max(0, max_depth - self._recovered))
+        self._overflow = max(0, self._recovered - max_depth)
+        self._overflow_lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._recovered:
+            print(f"Resuming {self._recovered} queued jobs")
+        for shard in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(shard,), name=f"queue-worker-{shard}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, key, payload):
+        """Queue a job, returning False if the queue stayed full for block_timeout seconds"""
+        if not self._slots.acquire(timeout=self.block_timeout):
+            self.rejected += 1
+            return False
+        self.backend.put(shard_for(key, self.workers), payload, key=key)
+        return True
+
+    def _release_slot(self):
+        # Recovered jobs beyond max_depth had no slot to give back
+        with self._overflow_lock:
+            if self._overflow:
+                self._overflow -= 1
+                return
+        self._slots.release()
+
+    def _run(self, shard):
+        while not self._stopping.is_set():
+            job = self.backend.get(shard, timeout=1.0)
+            if job is None:
+                continue
+            job_id, payload = job
+            try:
+                self.handler(payload)
+                self.processed += 1
+            except Exception as e:
+                # Failed jobs are dropped rather than retried, so one bad message cannot block its sender
+                self.failed += 1
+                print(f"Error processing queued job {job_id}: {str(e)}")
+            finally:
+                self.backend.ack(shard, job_id)
+                self._release_slot()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queued": len(self.backend),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,154 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytesseract
+from PIL import Image
+
+# OCR for scanned reports: pages without a text layer are rasterized at a
+# fixed DPI, cleaned up (grayscale, crop, downscale, deskew, binarize) and
+# read by Tesseract, several pages at a time in a process pool.
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_MAX_DIMENSION = int(os.getenv("OCR_MAX_DIMENSION", "2200"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+# Pages whose text layer has fewer characters than this are treated as scanned
+MIN_TEXT_CHARS = 20
+# LSTM engine, page read as one uniform block of text (suits result tables)
+TESSERACT_CONFIG = "--oem 1 --psm 6"
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.5
+# Used when an image has a single gray level (e.g. a blank page), where Otsu's method is undefined
+DEFAULT_THRESHOLD = 128
+
+
+def parse_region(value):
+    """Parse "left,top,right,bottom" page fractions (e.g. "0,0.2,1,0.7") into a tuple, or None"""
+    if not value:
+        return None
+    try:
+        left, top, right, bottom = (float(part) for part in value.split(","))
+    except ValueError:
+        print(f"Warning: Ignoring invalid OCR region '{value}'")
+        return None
+    if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+        print(f"Warning: Ignoring out-of-range OCR region '{value}'")
+        return None
+    return left, top, right, bottom
+
+
+# Part of the page holding the results table, when a lab's layout is known
+OCR_REGION = parse_region(os.getenv("OCR_REGION"))
+
+
+def crop_region(image, region):
+    if region is None:
+        return image
+    left, top, right, bottom = region
+    width, height = image.size
+    return image.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+
+
+def downscale(image, max_dimension=OCR_MAX_DIMENSION):
+    """Shrink an image so its longest side is at most max_dimension pixels"""
+    scale = max_dimension / max(image.size)
+    if scale >= 1:
+        return image
+    return image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+
+
+def otsu_threshold(pixels):
+    """Gray level that best separates ink from background (Otsu's method)"""
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    if np.count_nonzero(histogram) < 2:
+        return DEFAULT_THRESHOLD
+    weights = np.cumsum(histogram)
+    means = np.cumsum(histogram * np.arange(256))
+    total_weight, total_mean = weights[-1], means[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mean * weights - means * total_weight) ** 2 / (weights * (total_weight - weights))
+    return int(np.nanargmax(between))
+
+
+def binarize(image):
+    pixels = np.asarray(image, dtype=np.uint8)
+    return Image.fromarray(np.where(pixels > otsu_threshold(pixels), 255, 0).astype(np.uint8))
+
+
+def estimate_skew(image):
+    """Angle in degrees that makes text lines horizontal, found by maximizing row-profile variance"""
+    sample = downscale(image, 800)
+    ink = Image.fromarray((np.asarray(sample, dtype=np.uint8) < otsu_threshold(np.asarray(sample))).astype(np.uint8) * 255)
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES / 2, SKEW_STEP_DEGREES):
+        rows = np.asarray(ink.rotate(angle, resample=Image.NEAREST, fillcolor=0), dtype=np.float64).sum(axis=1)
+        score = rows.var()
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def is_uniform(image):
+    """Whether every pixel has the same gray level, so there is no text to align"""
+    low, high = image.getextrema()
+    return low == high
+
+
+def deskew(image):
+    if is_uniform(image):
+        return image
+    angle = estimate_skew(image)
+    if abs(angle) < SKEW_STEP_DEGREES / 2:
+        return image
+    return image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+def preprocess(image, region=None):
+    """Prepare a page image for Tesseract: grayscale, crop to region, downscale, deskew, binarize"""
+    image = crop_region(image.convert("L"), region)
+    return binarize(deskew(downscale(image)))
+
+
+def ocr_image(image, region=OCR_REGION):
+    return pytesseract.image_to_string(preprocess(image, region), config=TESSERACT_CONFIG)
+
+
+def ocr_pdf_page(pdf_bytes, page_number, dpi=OCR_DPI, region=OCR_REGION):
+    """Rasterize and OCR one 1-based page of a PDF"""
+    # Imported here so processes that never see a scanned PDF do not need poppler
+    from pdf2image import convert_from_bytes
+    images = convert_from_bytes(pdf_bytes, dpi=dpi, first_page=page_number, last_page=page_number,
+                                grayscale=True)
+    return ocr_image(images[0], region) if images else ""
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned so workers do not inherit the threads of the app that started them
+                _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def parallel_ocr_available():
+    """Whether pages can be OCRed in the shared process pool.
+
+    Inside a worker process (e.g. batch extraction) pages are read inline
+    instead of nesting pools.
+    """
+    return OCR_WORKERS > 1 and multiprocessing.parent_process() is None
+
+
+def submit_pdf_page(pdf_bytes, page_number, dpi=OCR_DPI, region=OCR_REGION):
+    """Start OCR of one 1-based PDF page in the shared process pool, returning its Future"""
+    return _get_pool().submit(ocr_pdf_page, pdf_bytes, page_number, dpi, region)
+
+
+def is_textless(text):
+    return len((text or "").strip()) < MIN_TEXT_CHARS
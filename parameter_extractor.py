@@ -0,0 +1,201 @@
+import os
+import re
+
+# Single-pass parameter extraction: every label of every parameter is one
+# alternative of a single compiled pattern, so each report page is scanned
+# once. Each hit is scored by how specific its label is, whether its unit
+# fits the parameter, whether its value is plausible and whether it sits in
+# an HPLC table, and the best hit per parameter wins.
+PARAMETERS = ('RBC', 'HGB', 'MCV', 'MCH', 'MCHC', 'RDW',
+              'F_concentration', 'A2_concentration', 'Ao_peak', 'S_peak')
+
+UNIT_PATTERN = (r"%|g/dL|g/L|fL|pg|(?:x\s*)?10\^?(?:12|6)\s*/\s*(?:L|[uµ]L)"
+                r"|(?:mill|M|T)/(?:[uµ]L|mm3|cmm)")
+
+# Accepted units per parameter (lower case, spaces removed)
+EXPECTED_UNITS = {
+    'RBC': ('x10^12/l', '10^12/l', 'x10^6/ul', '10^6/ul', 'x10^6/µl', '10^6/µl',
+            'm/ul', 'm/µl', 'mill/mm3', 'mill/cmm', 't/l'),
+    'HGB': ('g/dl', 'g/l'),
+    'MCV': ('fl',),
+    'MCH': ('pg',),
+    'MCHC': ('g/dl', 'g/l', '%'),
+    'RDW': ('%',),
+    'F_concentration': ('%',),
+    'A2_concentration': ('%',),
+    'Ao_peak': ('%',),
+    'S_peak': ('%',),
+}
+
+# Values outside these ranges are almost certainly misreads
+PLAUSIBLE_RANGES = {
+    'RBC': (0.5, 10),
+    'HGB': (2, 25),
+    'MCV': (40, 150),
+    'MCH': (10, 50),
+    'MCHC': (20, 45),
+    'RDW': (8, 40),
+    'F_concentration': (0, 100),
+    'A2_concentration': (0, 15),
+    'Ao_peak': (0, 100),
+    'S_peak': (0, 100),
+}
+
+# Reported in g/L by some labs; converted to the g/dL the app uses
+PER_LITRE_TO_DECILITRE = ('HGB', 'MCHC')
+# Confidence every parameter needs before later pages can be skipped
+COMPLETE_CONFIDENCE = 0.8
+
+# Below an HPLC table header, bare labels such as "F" and "A2" are peak
+# names rather than stray letters, so hits there are trusted more
+HPLC_PARAMETERS = ('F_concentration', 'A2_concentration', 'Ao_peak', 'S_peak')
+HPLC_HEADER = re.compile(r"\bHPLC\b|Peak\s+Name|Retention\s+Time|Calibrated\s+Area", re.IGNORECASE)
+HPLC_TABLE_BOOST = 0.2
+
+
+class ExtractionProfile:
+    """Labels a lab's reports use for each parameter, with how much each label is trusted.
+
+    labels maps a parameter to (regex, weight) pairs; each regex must start
+    with a letter, and weight is the confidence given to a value found after
+    that label (0-1).
+    """
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self._aliases = [
+            (parameter, weight, re.compile(r"(?:" + label + r")", re.IGNORECASE))
+            for parameter, parameter_labels in labels.items()
+            for label, weight in parameter_labels
+        ]
+        alternatives = "|".join(label for parameter_labels in labels.values() for label, _ in parameter_labels)
+        self.pattern = re.compile(
+            # Labels start with a letter; checking that first lets the scan
+            # skip most positions without trying every alternative
+            r"(?=[a-z])(?<![\w.])(?P<label>" + alternatives + r")"
+            r"(?:\s*\([^)\n]{0,20}\))?[ \t]*[:=]?[ \t]*"
+            r"(?P<value>\d+(?:[.,]\d+)?)\*?"
+            r"(?:[ \t]*(?P<unit>" + UNIT_PATTERN + r"))?",
+            re.IGNORECASE
+        )
+        self._resolved = {}
+
+    def alias(self, match):
+        """(parameter, weight, label text) of the label a match was made on"""
+        label = match.group("label")
+        if label not in self._resolved:
+            start, end = match.span("label")
+            # The first alias that matches the same text is the alternative the scan took
+            for parameter, weight, pattern in self._aliases:
+                found = pattern.match(match.string, start)
+                if found and found.end() == end:
+                    self._resolved[label] = (parameter, weight)
+                    break
+            else:
+                raise ValueError(f"Match has no label: {label}")
+        return (*self._resolved[label], label)
+
+
+DEFAULT_PROFILE = ExtractionProfile("default", {
+    'RBC': [(r"RBC\b", 0.95), (r"R\.B\.C\.?", 0.9), (r"Red\s+(?:Blood\s+)?Cell(?:s|\s+Count)?\b", 0.9)],
+    'HGB': [(r"HGB\b", 0.95), (r"Hb\b(?!\s*[AFS]\d?\b)", 0.8), (r"Ha?emoglobin\b(?!\s*[AFS]\d?\b)", 0.9)],
+    'MCV': [(r"MCV\b", 0.95)],
+    # MCH must not match the start of MCHC
+    'MCH': [(r"MCH\b", 0.95)],
+    'MCHC': [(r"MCHC\b", 0.95)],
+    'RDW': [(r"RDW(?:-CV)?\b", 0.95)],
+    'F_concentration': [(r"(?:Hb\s*)?F\s+Concentration\b", 0.95), (r"Hb\s*F\b", 0.9),
+                        (r"F(?=[ \t]+\d|[ \t]*[:=])", 0.6)],
+    'A2_concentration': [(r"(?:Hb\s*)?A2\s+Concentration\b", 0.95), (r"Hb\s*A2\b", 0.9), (r"A2\b", 0.75)],
+    'Ao_peak': [(r"A[o0][ \t\w]{0,40}?Calibrated\s+Area\b", 0.9), (r"A[o0]\s+Peak\b", 0.85)],
+    'S_peak': [(r"S[ \t\w]{0,40}?Calibrated\s+Area\b", 0.85), (r"(?:Hb\s*)?S\s+Peak\b", 0.85)],
+})
+
+PROFILES = {DEFAULT_PROFILE.name: DEFAULT_PROFILE}
+
+
+def register_profile(profile):
+    """Make a lab-specific profile selectable by name (e.g. via EXTRACTION_PROFILE)"""
+    PROFILES[profile.name] = profile
+    return profile
+
+
+def get_profile(profile=None):
+    if isinstance(profile, ExtractionProfile):
+        return profile
+    name = profile or os.getenv("EXTRACTION_PROFILE", DEFAULT_PROFILE.name)
+    if name not in PROFILES:
+        raise ValueError(f"Unknown extraction profile '{name}'. Choose from: {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+
+def _score(parameter, weight, value, unit, in_hplc_table=False):
+    """Confidence of a hit, and its value converted to the app's units"""
+    confidence = weight
+    if in_hplc_table and parameter in HPLC_PARAMETERS:
+        confidence += HPLC_TABLE_BOOST
+    if unit:
+        normalized = "".join(unit.split()).lower()
+        if normalized in EXPECTED_UNITS[parameter]:
+            confidence += 0.1
+            if normalized == 'g/l' and parameter in PER_LITRE_TO_DECILITRE:
+                value /= 10
+        else:
+            confidence -= 0.3
+    low, high = PLAUSIBLE_RANGES[parameter]
+    if not low <= value <= high:
+        confidence *= 0.3
+    return round(max(0.0, min(1.0, confidence)), 3), value
+
+
+def is_complete(details, min_confidence=COMPLETE_CONFIDENCE):
+    """Whether every parameter has been found with at least min_confidence"""
+    return all(detail is not None and detail["confidence"] >= min_confidence for detail in details.values())
+
+
+def extract_parameter_details(pages, profile=None, stop_when_complete=False):
+    """Find each parameter in a report's text (a string or an iterable of page texts).
+
+    Returns {parameter: None or {"value", "unit", "page", "offset",
+    "confidence", "label"}}, with the page 1-based and the offset the
+    position of the value within that page's text. With stop_when_complete,
+    pages are consumed only until every parameter has a confident value,
+    so a lazy page iterator is not read further than needed.
+    """
+    profile = get_profile(profile)
+    if isinstance(pages, str):
+        pages = [pages]
+    best = dict.fromkeys(PARAMETERS)
+    for page_number, text in enumerate(pages, start=1):
+        text = text or ""
+        header = HPLC_HEADER.search(text)
+        hplc_start = header.start() if header else len(text)
+        for match in profile.pattern.finditer(text):
+            parameter, weight, label = profile.alias(match)
+            value = float(match.group("value").replace(",", "."))
+            confidence, value = _score(parameter, weight, value, match.group("unit"),
+                                       match.start() > hplc_start)
+            current = best[parameter]
+            if current is not None and current["value"] == value:
+                # The same value reported twice (e.g. summary and table) is more trustworthy
+                current["confidence"] = round(min(1.0, max(current["confidence"], confidence) + 0.05), 3)
+                continue
+            if current is None or confidence > current["confidence"]:
+                best[parameter] = {
+                    "value": value,
+                    "unit": match.group("unit"),
+                    "page": page_number,
+                    "offset": match.start("value"),
+                    "confidence": confidence,
+                    "label": label.strip(),
+                }
+        # Checked after each page so the next one is never read unnecessarily
+        if stop_when_complete and is_complete(best):
+            break
+    return best
+
+
+def parameter_values(details):
+    """Reduce extract_parameter_details output to {parameter: value or None}"""
+    return {parameter: detail["value"] if detail else None for parameter, detail in details.items()}
@@ -0,0 +1,331 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+PARAMETERS = ('RBC', 'HGB', 'MCV', 'MCH', 'MCHC', 'RDW',
+              'F_concentration', 'A2_concentration', 'Ao_peak', 'S_peak')
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    phone_number TEXT NOT NULL UNIQUE,
+    name TEXT,
+    registered_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    patient_id INTEGER REFERENCES patients (id) ON DELETE SET NULL,
+    filename TEXT,
+    file_digest TEXT,
+    report_date TEXT NOT NULL,
+    -- Increases with every write to the report's values, so readers can pick up changes
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS reports_by_patient_date ON reports (patient_id, report_date);
+CREATE INDEX IF NOT EXISTS reports_by_date ON reports (report_date);
+CREATE INDEX IF NOT EXISTS reports_by_revision ON reports (revision);
+CREATE TABLE IF NOT EXISTS parameter_values (
+    report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+    parameter TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (report_id, parameter)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS assessments (
+    id INTEGER PRIMARY KEY,
+    report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+    system_assessment TEXT NOT NULL,
+    analysis_path TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assessments_by_report ON assessments (report_id);
+CREATE TABLE IF NOT EXISTS pathologist_notes (
+    id INTEGER PRIMARY KEY,
+    report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+    note TEXT NOT NULL,
+    author TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_by_report ON pathologist_notes (report_id);
+"""
+
+
+class ConnectionPool:
+    """A fixed number of SQLite connections shared by all threads of a process.
+
+    Connections are opened on first use in WAL mode, so readers never block
+    the writer and the Streamlit app and the WhatsApp webhook process can
+    use the same file at once.
+    """
+
+    def __init__(self, path, size=4, timeout=30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for one transaction, committed on success and rolled back on error"""
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                opening = self._opened < self.size
+                if opening:
+                    self._opened += 1
+            if opening:
+                try:
+                    connection = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                connection = self._idle.get(timeout=self.timeout)
+        try:
+            with connection:
+                yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._opened = 0
+
+
+class PatientRepository:
+    """Patients, their reports, parameter values, assessments and pathologist notes.
+
+    Patients are identified by their WhatsApp number. Dates are stored as
+    "YYYY-MM-DD HH:MM:SS" text, so date ranges are plain string comparisons
+    that use the (patient, date) index.
+    """
+
+    def __init__(self, path, pool_size=4):
+        self.pool = ConnectionPool(path, pool_size)
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    @contextmanager
+    def _connection(self):
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    with self.pool.connection() as connection:
+                        connection.executescript(SCHEMA)
+                    self._schema_ready = True
+        with self.pool.connection() as connection:
+            yield connection
+
+    # Writers are serialized by SQLite, so this is unique within the write transaction
+    _NEXT_REVISION = "SELECT COALESCE(MAX(revision), 0) + 1 FROM reports"
+
+    @staticmethod
+    def _now():
+        return datetime.now().strftime(DATE_FORMAT)
+
+    def register_patient(self, phone_number, name=None):
+        """Add a patient (or update their name), returning their id"""
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO patients (phone_number, name, registered_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (phone_number) DO UPDATE SET name = COALESCE(excluded.name, patients.name)",
+                (phone_number, name, self._now())
+            )
+            return connection.execute(
+                "SELECT id FROM patients WHERE phone_number = ?", (phone_number,)
+            ).fetchone()["id"]
+
+    def get_patient(self, phone_number):
+        with self._connection() as connection:
+            row = connection.execute(
+                "SELECT id, phone_number, name, registered_at FROM patients WHERE phone_number = ?",
+                (phone_number,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def is_registered(self, phone_number):
+        return self.get_patient(phone_number) is not None
+
+    def list_patients(self):
+        """WhatsApp numbers of all registered patients, in registration order"""
+        with self._connection() as connection:
+            rows = connection.execute("SELECT phone_number FROM patients ORDER BY id").fetchall()
+        return [row["phone_number"] for row in rows]
+
+    def save_report(self, parameters, assessment=None, patient_number=None, filename=None,
+                    file_digest=None, report_date=None):
+        """Store a report's parameter values (and its assessment, if given), returning the report id.
+
+        A patient_number that is not registered yet is registered.
+        """
+        with self._connection() as connection:
+            patient_id = None
+            if patient_number:
+                connection.execute(
+                    "INSERT OR IGNORE INTO patients (phone_number, registered_at) VALUES (?, ?)",
+                    (patient_number, self._now())
+                )
+                patient_id = connection.execute(
+                    "SELECT id FROM patients WHERE phone_number = ?", (patient_number,)
+                ).fetchone()["id"]
+            report_id = connection.execute(
+                "INSERT INTO reports (patient_id, filename, file_digest, report_date, revision)"
+                f" VALUES (?, ?, ?, ?, ({self._NEXT_REVISION}))",
+                (patient_id, filename, file_digest, report_date or self._now())
+            ).lastrowid
+            connection.executemany(
+                "INSERT INTO parameter_values (report_id, parameter, value) VALUES (?, ?, ?)",
+                [(report_id, name, parameters.get(name)) for name in PARAMETERS if name in parameters]
+            )
+            if assessment:
+                self._insert_assessment(connection, report_id, assessment)
+        return report_id
+
+    def update_report(self, report_id, parameters, assessment=None):
+        """Replace a report's parameter values (e.g. after manual corrections), adding the new assessment"""
+        with self._connection() as connection:
+            connection.execute(f"UPDATE reports SET revision = ({self._NEXT_REVISION}) WHERE id = ?", (report_id,))
+            connection.execute("DELETE FROM parameter_values WHERE report_id = ?", (report_id,))
+            connection.executemany(
+                "INSERT INTO parameter_values (report_id, parameter, value) VALUES (?, ?, ?)",
+                [(report_id, name, parameters.get(name)) for name in PARAMETERS if name in parameters]
+            )
+            if assessment:
+                self._insert_assessment(connection, report_id, assessment)
+
+    def _insert_assessment(self, connection, report_id, assessment):
+        connection.execute(
+            "INSERT INTO assessments (report_id, system_assessment, analysis_path, created_at)"
+            " VALUES (?, ?, ?, ?)",
+            (report_id, assessment.get('system_assessment', ''), assessment.get('analysis_path'), self._now())
+        )
+
+    def save_assessment(self, report_id, assessment):
+        with self._connection() as connection:
+            self._insert_assessment(connection, report_id, assessment)
+
+    def add_pathologist_note(self, report_id, note, author=None):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO pathologist_notes (report_id, note, author, created_at) VALUES (?, ?, ?, ?)",
+                (report_id, note, author, self._now())
+            )
+
+    def _load_reports(self, connection, rows):
+        """Report dicts with parameters, latest assessment and notes for report rows"""
+        reports = {}
+        for row in rows:
+            reports[row["id"]] = {
+                **dict(row),
+                "parameters": dict.fromkeys(PARAMETERS),
+                "assessment": None,
+                "pathologist_notes": [],
+            }
+        if not reports:
+            return []
+        ids = list(reports)
+        placeholders = ",".join("?" * len(ids))
+        for row in connection.execute(
+            f"SELECT report_id, parameter, value FROM parameter_values WHERE report_id IN ({placeholders})", ids
+        ):
+            reports[row["report_id"]]["parameters"][row["parameter"]] = row["value"]
+        for row in connection.execute(
+            "SELECT report_id, system_assessment, analysis_path, created_at FROM assessments"
+            f" WHERE report_id IN ({placeholders}) ORDER BY id", ids
+        ):
+            reports[row["report_id"]]["assessment"] = {
+                "system_assessment": row["system_assessment"],
+                "analysis_path": row["analysis_path"],
+                "created_at": row["created_at"],
+            }
+        for row in connection.execute(
+            "SELECT report_id, note, author, created_at FROM pathologist_notes"
+            f" WHERE report_id IN ({placeholders}) ORDER BY id", ids
+        ):
+            reports[row["report_id"]]["pathologist_notes"].append(
+                {"note": row["note"], "author": row["author"], "created_at": row["created_at"]}
+            )
+        return list(reports.values())
+
+    _REPORT_COLUMNS = ("SELECT r.id, p.phone_number AS patient_number, r.filename, r.file_digest, r.report_date"
+                       " FROM reports r LEFT JOIN patients p ON p.id = r.patient_id")
+
+    def get_report(self, report_id):
+        with self._connection() as connection:
+            rows = connection.execute(f"{self._REPORT_COLUMNS} WHERE r.id = ?", (report_id,)).fetchall()
+            reports = self._load_reports(connection, rows)
+        return reports[0] if reports else None
+
+    def list_reports(self, patient_number=None, start=None, end=None, limit=None):
+        """Reports, newest first, optionally for one patient and within [start, end] dates.
+
+        start and end are datetimes or "YYYY-MM-DD[ HH:MM:SS]" strings; a
+        date-only end includes that whole day.
+        """
+        clauses, args = [], []
+        if patient_number is not None:
+            clauses.append("r.patient_id = (SELECT id FROM patients WHERE phone_number = ?)")
+            args.append(patient_number)
+        if start is not None:
+            clauses.append("r.report_date >= ?")
+            args.append(_date_text(start))
+        if end is not None:
+            end = _date_text(end)
+            clauses.append("r.report_date <= ?")
+            args.append(end + " 23:59:59" if len(end) == 10 else end)
+        sql = self._REPORT_COLUMNS
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY r.report_date DESC, r.id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        with self._connection() as connection:
+            return self._load_reports(connection, connection.execute(sql, args).fetchall())
+
+    def parameter_rows(self, after_revision=0):
+        """(revision, report_id, patient_number, report_date, parameter, value) for patient reports
+        stored or updated after a revision"""
+        with self._connection() as connection:
+            return [tuple(row) for row in connection.execute(
+                "SELECT r.revision, r.id, p.phone_number, r.report_date, v.parameter, v.value"
+                " FROM reports r JOIN patients p ON p.id = r.patient_id"
+                " JOIN parameter_values v ON v.report_id = r.id"
+                " WHERE r.revision > ? ORDER BY r.revision",
+                (after_revision,)
+            )]
+
+    def latest_report(self, patient_number):
+        reports = self.list_reports(patient_number, limit=1)
+        return reports[0] if reports else None
+
+
+def _date_text(value):
+    return value.strftime(DATE_FORMAT) if isinstance(value, datetime) else str(value)
+
+
+# Shared by every session of the app and every worker of the webhook process
+repository = PatientRepository(
+    os.getenv("PATIENT_DB_PATH", "patients.db"),
+    pool_size=int(os.getenv("PATIENT_DB_POOL_SIZE", "4"))
+)
@@ -1,63 +1,163 @@
 import PyPDF2
-import pdf2image
-import pytesseract
 from PIL import Image
 import io
-import re
+import os
+import time
+import logging
+import hashlib
+from functools import lru_cache
+from cache import LRUCache
+from collections import deque
+from ocr_engine import (
+    OCR_WORKERS, ocr_image, ocr_pdf_page, submit_pdf_page, parallel_ocr_available, is_textless
+)
+from parameter_extractor import extract_parameter_details, parameter_values
 
-def extract_text_from_pdf(pdf_file):
-    pdf_reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
+# Per-page read timings; enable with logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Text layer reader: "pypdfium2" (faster, optional dependency), "pypdf2",
+# or "auto" to use pypdfium2 when it is installed
+PDF_BACKEND = os.getenv("PDF_BACKEND", "auto").lower()
+
+def _pypdf2_pages(pdf_bytes):
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
     for page in pdf_reader.pages:
-        text += page.extract_text()
-    return text
+        yield page.extract_text() or ""
+
+def _pdfium_pages(pdf_bytes):
+    import pypdfium2 as pdfium
+    document = pdfium.PdfDocument(pdf_bytes)
+    try:
+        for index in range(len(document)):
+            page = document[index]
+            text_page = page.get_textpage()
+            try:
+                text = text_page.get_text_range()
+            finally:
+                text_page.close()
+                page.close()
+            yield text.replace("\r\n", "\n")
+    finally:
+        document.close()
+
+PAGE_READERS = {"pypdf2": _pypdf2_pages, "pypdfium2": _pdfium_pages}
+
+@lru_cache(maxsize=None)
+def get_pdf_backend():
+    if PDF_BACKEND in ("auto", "pypdfium2"):
+        try:
+            import pypdfium2  # noqa: F401
+            return "pypdfium2"
+        except ImportError:
+            if PDF_BACKEND == "pypdfium2":
+                print("Warning: pypdfium2 is not installed, falling back to PyPDF2")
+    elif PDF_BACKEND != "pypdf2":
+        print(f"Warning: Unknown PDF_BACKEND '{PDF_BACKEND}', using PyPDF2")
+    return "pypdf2"
+
+def _read_bytes(pdf_file):
+    return pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file.read()
+
+def iter_pdf_pages(pdf_bytes, timings=None):
+    """Yield the text of each page of a PDF, reading each page only when it is requested.
+
+    Pages without a text layer are OCRed. Once one is found, the following
+    pages are read ahead so that up to OCR_WORKERS scanned pages are OCRed
+    in parallel in the shared pool; work still pending when the caller
+    stops early is cancelled. If timings is a list, a {"page", "source",
+    "seconds"} entry is appended for each page yielded, with seconds being
+    the time spent reading it or waiting for its OCR.
+    """
+    backend = get_pdf_backend()
+    reader = PAGE_READERS[backend](pdf_bytes)
+    lookahead = OCR_WORKERS if parallel_ocr_available() else 0
+    # (page_number, text, OCR future or None, seconds spent reading the text layer)
+    buffered = deque()
+    read = 0
+
+    def read_page():
+        nonlocal read
+        started = time.perf_counter()
+        text = next(reader, None)
+        if text is None:
+            return False
+        read += 1
+        future = submit_pdf_page(pdf_bytes, read) if lookahead and is_textless(text) else None
+        buffered.append((read, text, future, time.perf_counter() - started))
+        return True
+
+    try:
+        while buffered or read_page():
+            # Keep the pool busy while scanned pages are waiting to be yielded
+            while lookahead and len(buffered) < 2 * lookahead \
+                    and 0 < sum(future is not None for _, _, future, _ in buffered) < lookahead:
+                if not read_page():
+                    break
+            page_number, text, future, seconds = buffered.popleft()
+            started = time.perf_counter()
+            source = backend
+            if future is not None or is_textless(text):
+                try:
+                    text = future.result() if future is not None else ocr_pdf_page(pdf_bytes, page_number)
+                    source = "ocr"
+                except Exception as e:
+                    # Values on pages with a text layer can still be extracted
+                    print(f"Warning: OCR of page {page_number} failed: {str(e)}")
+            if timings is not None:
+                timings.append({"page": page_number, "source": source,
+                                "seconds": seconds + time.perf_counter() - started})
+            yield text
+    finally:
+        for _, _, future, _ in buffered:
+            if future is not None:
+                future.cancel()
+        reader.close()
+
+def extract_text_from_pdf(pdf_file):
+    return "\n".join(iter_pdf_pages(_read_bytes(pdf_file)))
 
 def extract_text_from_image(image_file):
     image = Image.open(image_file)
-    text = pytesseract.image_to_string(image)
+    text = ocr_image(image)
     return text
 
-def extract_parameters(text):
-    # Initialize results dictionary
-    results = {
-        'RBC': None,
-        'HGB': None,
-        'MCV': None,
-        'MCH': None,
-        'MCHC': None,
-        'RDW': None,
-        'F_concentration': None,
-        'A2_concentration': None,
-        'Ao_peak': None,
-        'S_peak': None
-    }
-    
-    # Regular expressions for parameter extraction
-    patterns = {
-        'RBC': r'RBC[:\s]+(\d+\.?\d*)',
-        'HGB': r'HGB[:\s]+(\d+\.?\d*)',
-        'MCV': r'MCV[:\s]+(\d+\.?\d*)',
-        'MCH': r'MCH[:\s]+(\d+\.?\d*)',
-        'MCHC': r'MCHC[:\s]+(\d+\.?\d*)',
-        'RDW': r'RDW[:\s]+(\d+\.?\d*)',
-        'F_concentration': r'F[:\s]+(\d+\.?\d*)',
-        'A2_concentration': r'A2[:\s]+(\d+\.?\d*)',
-        'Ao_peak': r'Ao[\s\w]*Calibrated Area[:\s]+(\d+\.?\d*)',
-        'S_peak': r'S[\s\w]*Calibrated Area[:\s]+(\d+\.?\d*)'
-    }
-    
-    # Extract values using regex patterns
-    for param, pattern in patterns.items():
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            results[param] = float(match.group(1))
-    
-    return results
-
-def process_pdf_file(pdf_file):
-    text = extract_text_from_pdf(pdf_file)
-    return extract_parameters(text)
+def extract_parameters(text, profile=None):
+    """Extract the ten parameters from report text (a string or a list of page texts)"""
+    return parameter_values(extract_parameter_details(text, profile))
+
+def process_pdf_file(pdf_file, timings=None):
+    """Extract parameters from a PDF, reading pages only until all ten have been found"""
+    timings = [] if timings is None else timings
+    pages = iter_pdf_pages(_read_bytes(pdf_file), timings)
+    details = extract_parameter_details(pages, stop_when_complete=True)
+    pages.close()
+    summary = ", ".join(f"{t['page']}: {t['seconds'] * 1000:.1f} ms ({t['source']})" for t in timings)
+    logger.info("Read %d PDF page(s): %s", len(timings), summary)
+    return parameter_values(details)
 
 def process_image_file(image_file):
     text = extract_text_from_image(image_file)
     return extract_parameters(text)
+
+# Extraction results keyed by the SHA-256 of the uploaded bytes, so Streamlit
+# reruns and repeat uploads of a report skip PDF parsing and OCR (optionally
+# persisted via EXTRACTION_CACHE_PATH). Bump EXTRACTION_VERSION whenever
+# extraction output changes so stale results are not reused.
+EXTRACTION_VERSION = 4
+extraction_cache = LRUCache(
+    int(os.getenv("EXTRACTION_CACHE_SIZE", "256")),
+    path=os.getenv("EXTRACTION_CACHE_PATH"),
+    namespace="extraction"
+)
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def process_report_bytes(data, is_pdf, digest=None):
+    """Extract parameters from report bytes, reusing the result for identical files"""
+    digest = digest or file_digest(data)
+    key = f"v{EXTRACTION_VERSION}:{'pdf' if is_pdf else 'image'}:{digest}"
+    process = process_pdf_file if is_pdf else process_image_file
+    # Copied so callers can modify the result without changing the cached entry
+    return dict(extraction_cache.get_or_set(key, lambda: process(io.BytesIO(data))))
@@ -0,0 +1,113 @@
+# Headless extraction and analysis pipeline: pdf_processor -> analyze_results ->
+# export_handler without Streamlit, for cron jobs, queue workers and batch nodes.
+#
+#   python -m pipeline reports/ extra.pdf > results.jsonl
+#   find /incoming -name '*.pdf' | python -m pipeline --paths-from-stdin
+#   cat report.pdf | python -m pipeline -
+#
+# From Python, run_pipeline yields one result dict per report as it completes.
+import os
+import sys
+import argparse
+from batch_analysis import (
+    DEFAULT_ANALYSIS_WORKERS, expand_uploads, directory_reports, is_supported_report, iter_batch_results
+)
+from export_handler import export_batch_to_jsonl, export_batch_to_csv, export_batch_to_json
+
+STDIN_NAME = "<stdin>"
+
+
+def collect_reports(inputs):
+    """Resolve files, directories, ZIP archives and '-' (report bytes on stdin) to (name, source) reports"""
+    reports = []
+    for item in inputs:
+        if item == "-":
+            data = sys.stdin.buffer.read()
+            # Name the report after its type so extraction picks the right reader
+            extension = ".pdf" if data.startswith(b"%PDF") else ".png"
+            reports.append((STDIN_NAME + extension, data))
+        elif os.path.isdir(item):
+            reports.extend((os.path.join(item, name), path) for name, path in directory_reports(item))
+        elif item.lower().endswith(".zip"):
+            with open(item, 'rb') as f:
+                reports.extend(expand_uploads([(item, f.read())]))
+        elif is_supported_report(item):
+            reports.append((item, item))
+        else:
+            print(f"Skipping unsupported input: {item}", file=sys.stderr)
+    return reports
+
+
+def run_pipeline(inputs, extract_workers=None, analysis_workers=DEFAULT_ANALYSIS_WORKERS):
+    """Extract and analyze reports, yielding a result dict per report as it completes.
+
+    inputs are paths of reports, directories or ZIP archives, or '-' for a
+    report read from stdin. Each result has filename, status ("ok" or
+    "error"), parameters, assessment and error.
+    """
+    return iter_batch_results(collect_reports(inputs), extract_workers, analysis_workers)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract and analyze hemoglobinopathy reports without the UI")
+    parser.add_argument('inputs', nargs='*',
+                        help="Report files, directories or ZIP archives; '-' reads one report from stdin")
+    parser.add_argument('--paths-from-stdin', action='store_true',
+                        help="Read input paths from stdin, one per line")
+    parser.add_argument('--format', choices=['jsonl', 'csv', 'json'], default='jsonl',
+                        help="Output format; jsonl streams one line per report as it completes (default)")
+    parser.add_argument('--output', '-o', default='-', help="Output file (default: stdout)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Extraction processes (default: one per CPU)")
+    parser.add_argument('--analysis-workers', type=int, default=DEFAULT_ANALYSIS_WORKERS,
+                        help=f"Concurrent analyses (default: {DEFAULT_ANALYSIS_WORKERS})")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    inputs = list(args.inputs)
+    if args.paths_from_stdin:
+        inputs.extend(line.strip() for line in sys.stdin if line.strip())
+    if not inputs:
+        print("No inputs given", file=sys.stderr)
+        return 2
+
+    # Progress and library messages go to stderr so stdout holds only results.
+    # Redirecting fd 1 as well covers the spawned extraction workers, which
+    # inherit it; results are written to a duplicate of the original stdout.
+    stdout = sys.stdout
+    stdout.flush()
+    results_fd = os.dup(stdout.fileno())
+    os.dup2(sys.stderr.fileno(), stdout.fileno())
+    sys.stdout = sys.stderr
+    output = os.fdopen(results_fd, 'w') if args.output == '-' else open(args.output, 'w')
+    failed = 0
+    try:
+        results = []
+        for result in run_pipeline(inputs, args.workers, args.analysis_workers):
+            failed += result['status'] == 'error'
+            if args.format == 'jsonl':
+                output.writelines(export_batch_to_jsonl([result]))
+                output.flush()
+            else:
+                results.append(result)
+        if args.format == 'csv':
+            output.write(export_batch_to_csv(results))
+        elif args.format == 'json':
+            output.write(export_batch_to_json(results))
+    finally:
+        output.flush()
+        os.dup2(results_fd, stdout.fileno())
+        sys.stdout = stdout
+        output.close()
+        if args.output != '-':
+            os.close(results_fd)
+
+    if failed:
+        print(f"{failed} report(s) failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
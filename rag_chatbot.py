@@ -1,122 +1,386 @@
 import os
 import faiss
 import numpy as np
-from openai import OpenAI
-import json
+import hashlib
+import re
+import time
+import threading
+from collections import namedtuple
 from medical_knowledge import MEDICAL_KNOWLEDGE
+from chunk_store import ChunkStore, convert_json_chunks
+from embeddings import get_embedding_backend, backend_for_index, read_index_metadata
+from cache import LRUCache
+from dedup import select_distinct
+from llm_gateway import chat_completion, stream_chat_completion
 
 # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # do not change this unless explicitly requested by the user
-try:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-except Exception as e:
-    print(f"Failed to initialize OpenAI client: {str(e)}")
 
-def load_embeddings_and_index():
-    """Load pre-trained embeddings and FAISS index"""
+ASSETS_DIR = "attached_assets"
+
+# Patients ask the same questions repeatedly, so query embeddings and the
+# chunk IDs retrieved for them are cached (optionally on disk via RAG_CACHE_PATH)
+_cache_size = int(os.getenv("RAG_CACHE_SIZE", "1024"))
+_cache_ttl = float(os.getenv("RAG_CACHE_TTL", str(24 * 60 * 60)))
+query_embedding_cache = LRUCache(_cache_size, _cache_ttl, os.getenv("RAG_CACHE_PATH"), "query_embeddings")
+retrieval_cache = LRUCache(_cache_size, _cache_ttl, os.getenv("RAG_CACHE_PATH"), "retrieval")
+
+def normalize_query(query):
+    """Normalize query text so trivially different phrasings share cache entries"""
+    return " ".join(re.sub(r"[^\w\s]", " ", query.lower()).split())
+
+def get_cache_stats():
+    """Hit/miss counters for the query embedding and retrieval caches"""
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+    }
+
+def open_chunk_store(assets_dir=ASSETS_DIR):
+    """Open the binary chunk store, converting the legacy chunks.json on first use"""
+    store_path = os.path.join(assets_dir, "chunks.bin")
+    json_path = os.path.join(assets_dir, "chunks.json")
+    if not os.path.exists(store_path) and os.path.exists(json_path):
+        count = convert_json_chunks(json_path, store_path)
+        print(f"Converted {count} chunks from chunks.json to the binary chunk store")
+    return ChunkStore(store_path)
+
+def configure_search(index, metadata):
+    """Apply approximate-search settings from RAG_NPROBE / RAG_EF_SEARCH or the index metadata.
+
+    Returns a suffix describing the applied settings, since they change search results.
+    """
+    applied = ""
+    for name, env_var, key in (("nprobe", "RAG_NPROBE", "nprobe"), ("efSearch", "RAG_EF_SEARCH", "ef_search")):
+        value = os.getenv(env_var) or metadata.get(key)
+        if not value:
+            continue
+        try:
+            faiss.ParameterSpace().set_index_parameter(index, name, int(value))
+            applied += f"-{name}{int(value)}"
+        except RuntimeError:
+            pass  # Not applicable to this index type (e.g. nprobe on HNSW)
+    return applied
+
+PretrainedIndex = namedtuple("PretrainedIndex", ["index", "backend", "chunks", "version"])
+
+def _file_stamp(path):
+    """Modification stamp of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+def load_embeddings_and_index(assets_dir=ASSETS_DIR):
+    """Load pre-trained FAISS index, its embedding backend and the chunk store it was built from"""
     try:
-        # Load the pre-computed embeddings
-        embeddings = np.load("attached_assets/embeddings.npy")
         # Load the FAISS index
-        index = faiss.read_index("attached_assets/faiss_index.index")
-        # Load chunks for context retrieval
-        with open("attached_assets/chunks.json", 'r') as f:
-            chunks = json.load(f)
-        print("Successfully loaded pre-trained embeddings and index")
-        return True, index, embeddings, chunks
+        index_path = os.path.join(assets_dir, "faiss_index.index")
+        # Identifies this build of the index in retrieval cache keys
+        stamp = _file_stamp(index_path)
+        index = faiss.read_index(index_path)
+        metadata = read_index_metadata(index_path)
+        # Queries must be embedded with the model recorded in the index metadata
+        backend = backend_for_index(index_path, index, metadata)
+        search_params = configure_search(index, metadata)
+        # Memory-map chunks for context retrieval
+        chunks = open_chunk_store(assets_dir)
+        print(f"Successfully loaded pre-trained index ({metadata.get('index_type', 'flat')}, {backend.model}, {index.d}-d)")
+        return PretrainedIndex(index, backend, chunks, f"{stamp}{search_params}")
     except Exception as e:
         print(f"Warning: Could not load pre-trained embeddings: {str(e)}")
-        return False, None, None, None
+        return None
+
+def _knowledge_hash(texts, backend):
+    """Content hash identifying a set of knowledge entries embedded with a given model"""
+    digest = hashlib.sha256(backend.key.encode("utf-8"))
+    for text in texts:
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+def _load_or_create_default_embeddings(texts, backend, cache_dir=ASSETS_DIR):
+    """Return embeddings for the default knowledge, reusing the on-disk copy when the content is unchanged"""
+    cache_path = os.path.join(cache_dir, f"default_embeddings_{_knowledge_hash(texts, backend)[:16]}.npy")
+    if os.path.exists(cache_path):
+        try:
+            embeddings = np.load(cache_path)
+            if len(embeddings) == len(texts):
+                return embeddings
+        except Exception as e:
+            print(f"Warning: Could not read cached default embeddings: {str(e)}")
+
+    embeddings = backend.embed(texts)
+
+    try:
+        # Write to a temporary file first so concurrent processes never read a partial file
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"Warning: Could not cache default embeddings: {str(e)}")
 
-def initialize_default_index():
+    return embeddings
+
+def initialize_default_index(cache_dir=ASSETS_DIR):
     """Initialize index with default medical knowledge"""
     try:
-        # Get embeddings for medical knowledge
-        embeddings = []
-        texts = []
-
-        for entry in MEDICAL_KNOWLEDGE:
-            response = client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=entry
-            )
-            embedding = response.data[0].embedding
-            embeddings.append(embedding)
-            texts.append(entry)
+        backend = get_embedding_backend()
+        texts = list(MEDICAL_KNOWLEDGE)
+        embeddings = _load_or_create_default_embeddings(texts, backend, cache_dir)
 
         # Create FAISS index
-        dimension = len(embeddings[0])
+        dimension = embeddings.shape[1]
         index = faiss.IndexFlatL2(dimension)
-        index.add(np.array(embeddings, dtype='float32'))
+        index.add(embeddings)
 
         print("Successfully initialized default knowledge base")
-        return index, texts
+        return index, backend, texts, _knowledge_hash(texts, backend)[:16]
     except Exception as e:
         print(f"Error initializing default index: {str(e)}")
-        return None, MEDICAL_KNOWLEDGE
+        return None, None, MEDICAL_KNOWLEDGE, None
+
+class KnowledgeBase:
+    """Process-wide knowledge sources for the chatbot, loaded on first use.
+
+    A single instance is shared by every Streamlit session and webhook request
+    in the process, so the indexes are built at most once. The pre-trained
+    index file is checked every RAG_RELOAD_INTERVAL seconds and swapped in
+    place when indexing.py replaces it, without restarting the process.
+    """
+
+    def __init__(self, assets_dir=ASSETS_DIR, reload_interval=None):
+        self.assets_dir = assets_dir
+        self.reload_interval = float(os.getenv("RAG_RELOAD_INTERVAL", "10")) if reload_interval is None else reload_interval
+        self.pretrained = None
+        self.default_index = None
+        self.default_backend = None
+        self.default_version = None
+        self.default_texts = MEDICAL_KNOWLEDGE
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        # Guards only the warm-up thread start, never held while loading
+        self._warm_up_lock = threading.Lock()
+        self._pretrained_stamp = None
+        self._next_reload_check = 0.0
+        self._warm_up_thread = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def index_path(self):
+        return os.path.join(self.assets_dir, "faiss_index.index")
+
+    def ensure_loaded(self):
+        """Load both knowledge sources if this has not happened yet"""
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._pretrained_stamp = _file_stamp(self.index_path)
+                    self.pretrained = load_embeddings_and_index(self.assets_dir)
+                    (self.default_index, self.default_backend, self.default_texts,
+                     self.default_version) = initialize_default_index(self.assets_dir)
+                    self._next_reload_check = time.monotonic() + self.reload_interval
+                    self._loaded = True
+        else:
+            self.reload_if_changed()
+        return self
+
+    def reload_if_changed(self):
+        """Swap in the pre-trained index if its file was replaced since it was loaded"""
+        now = time.monotonic()
+        if now < self._next_reload_check or not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_reload_check = now + self.reload_interval
+            stamp = _file_stamp(self.index_path)
+            if stamp is None or stamp == self._pretrained_stamp:
+                return False
+            # Remember the stamp even on failure so a broken file is not reloaded on every query
+            self._pretrained_stamp = stamp
+            pretrained = load_embeddings_and_index(self.assets_dir)
+            if pretrained is None:
+                return False
+            # One attribute assignment, so in-flight queries see either the old or the new index
+            self.pretrained = pretrained
+            print("Reloaded pre-trained index after it was rebuilt")
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def warm_up(self):
+        """Start loading in a background thread so the first query does not pay for it"""
+        with self._warm_up_lock:
+            if self._loaded or self._warm_up_thread is not None:
+                return self._warm_up_thread
+            self._warm_up_thread = threading.Thread(
+                target=self.ensure_loaded, name="knowledge-base-warm-up", daemon=True
+            )
+            self._warm_up_thread.start()
+            return self._warm_up_thread
+
+# Shared by all callers in this process; nothing is loaded until the first query
+knowledge_base = KnowledgeBase()
+
+# Candidates fetched per returned passage, so near-duplicates can be dropped
+RESULT_OVERFETCH = 3
+
+def _search(name, version, index, backend, query, k, get_text):
+    """Return the IDs of the k nearest distinct entries in an index, using the query caches"""
+    query_key = normalize_query(query)
+    cache_key = f"{name}:{version}:{k}x{RESULT_OVERFETCH}:{query_key}"
+    ids = retrieval_cache.get(cache_key)
+    if ids is None:
+        embedding = query_embedding_cache.get_or_set(
+            f"{backend.key}:{query_key}", lambda: backend.embed_query(query)
+        )
+        D, I = index.search(embedding.reshape(1, -1), k * RESULT_OVERFETCH)
+        # Duplicate passages (e.g. from copies of the same guideline) waste prompt tokens
+        ids = select_distinct([int(i) for i in I[0] if i >= 0], get_text, k)
+        retrieval_cache.set(cache_key, ids)
+    return ids
 
-# Initialize both knowledge sources
-use_pretrained, pretrained_index, pretrained_embeddings, chunks = load_embeddings_and_index()
-default_index, default_texts = initialize_default_index()
+# Chunks from the previous answer kept alongside new results for follow-up questions
+REUSED_CHUNKS = 2
+
+def _retrieve(name, version, index, backend, query, k, get_text, reuse):
+    ids = _search(name, version, index, backend, query, k, get_text)
+    context_ids = ids
+    # Chunk IDs are only meaningful within the index version they came from
+    if reuse is not None and reuse[:2] == (name, version):
+        context_ids = select_distinct(ids + [i for i in reuse[2] if i not in ids], get_text, k + REUSED_CHUNKS)
+    return "\n".join(get_text(i) for i in context_ids), (name, version, ids)
+
+def retrieve_context(query, use_pretrained_first=True, reuse=None):
+    """Return relevant context and a (source, version, chunk IDs) reference to it.
+
+    reuse is a reference returned for an earlier question; its chunks are
+    added to the new results, so follow-up questions keep the passages the
+    previous answer was based on. The reference is None for the raw
+    knowledge fallback.
+    """
+    kb = knowledge_base.ensure_loaded()
+    k = 3  # Number of relevant passages to retrieve
+
+    # Try pre-trained index first if available and requested
+    pretrained = kb.pretrained
+    if use_pretrained_first and pretrained is not None:
+        try:
+            # IDs of files removed by an incremental rebuild have no text and are skipped
+            return _retrieve("pretrained", pretrained.version, pretrained.index,
+                             pretrained.backend, query, k, pretrained.chunks.text, reuse)
+        except Exception as e:
+            print(f"Warning: Error using pre-trained index: {str(e)}. Falling back to default knowledge base.")
+
+    # Use default index as fallback
+    if kb.default_index is not None:
+        return _retrieve("default", kb.default_version, kb.default_index,
+                         kb.default_backend, query, k, kb.default_texts.__getitem__, reuse)
+
+    # Ultimate fallback to raw medical knowledge
+    return "\n".join(MEDICAL_KNOWLEDGE[:3]), None
 
 def get_relevant_context(query, use_pretrained_first=True):
     """Get relevant context from either pre-trained or default knowledge base"""
     try:
-        # Get query embedding
-        query_response = client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=query
-        )
-        query_embedding = query_response.data[0].embedding
-
-        # Try pre-trained index first if available and requested
-        if use_pretrained_first and use_pretrained and pretrained_index is not None:
-            try:
-                k = 3  # Number of relevant passages to retrieve
-                D, I = pretrained_index.search(np.array([query_embedding], dtype='float32'), k)
-                relevant_texts = [chunks[i]["chunk"] for i in I[0]]
-                return "\n".join(relevant_texts)
-            except Exception as e:
-                print(f"Warning: Error using pre-trained index: {str(e)}. Falling back to default knowledge base.")
-
-        # Use default index as fallback
-        if default_index is not None:
-            k = 3
-            D, I = default_index.search(np.array([query_embedding], dtype='float32'), k)
-            relevant_texts = [default_texts[i] for i in I[0]]
-            return "\n".join(relevant_texts)
-        else:
-            # Ultimate fallback to raw medical knowledge
-            return "\n".join(MEDICAL_KNOWLEDGE[:3])
-
+        return retrieve_context(query, use_pretrained_first)[0]
     except Exception as e:
         print(f"Warning: Error in similarity search: {str(e)}. Using default knowledge base.")
         return "\n".join(MEDICAL_KNOWLEDGE[:3])
 
-def get_chatbot_response(question):
-    """Generate response using relevant context"""
-    try:
-        # Get relevant context using RAG
-        context = get_relevant_context(question)
-
-        # Create prompt with context
-        prompt = f"""
+def _chatbot_messages(question, context, conversation=None):
+    prompt = f"""
         Using the following medical information about hemoglobinopathies:
         {context}
 
         Please answer this question in a clear and informative way:
         {question}
         """
+    history = conversation.messages() if conversation is not None else []
+    return [
+        {"role": "system", "content": "You are a medical expert helping explain hemoglobinopathies to patients and their families."},
+        *history,
+        {"role": "user", "content": prompt}
+    ]
+
+def _conversation_context(question, conversation):
+    """Retrieve context for a question asked partway through a conversation"""
+    try:
+        # Short follow-ups ("what about treatment?") retrieve better alongside the previous question
+        query = f"{conversation.last_question} {question}" if conversation.last_question else question
+        return retrieve_context(query, reuse=conversation.chunk_ref)
+    except Exception as e:
+        print(f"Warning: Error in similarity search: {str(e)}. Using default knowledge base.")
+        return "\n".join(MEDICAL_KNOWLEDGE[:3]), None
+
+def get_chatbot_response(question, conversation=None):
+    """Generate response using relevant context.
+
+    When a conversation (see conversation_memory.py) is given, its summary
+    and recent turns are included in the prompt and the new turn is recorded.
+    """
+    try:
+        # Get relevant context using RAG
+        if conversation is None:
+            context, chunk_ref = get_relevant_context(question), None
+        else:
+            context, chunk_ref = _conversation_context(question, conversation)
 
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a medical expert helping explain hemoglobinopathies to patients and their families."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=_chatbot_messages(question, context, conversation),
             temperature=0.7
         )
 
-        return response.choices[0].message.content
+        answer = response.choices[0].message.content
+        if conversation is not None:
+            conversation.add_turn(question, answer, chunk_ref)
+        return answer
+    except Exception as e:
+        raise Exception(f"Error getting chatbot response: {str(e)}")
+
+def summarize_conversation(summary, turns):
+    """Fold earlier (question, answer) turns into a short running summary"""
+    transcript = "\n".join(f"Patient: {question}\nAssistant: {answer}" for question, answer in turns)
+    response = chat_completion(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "Summarize this conversation between a patient and a hemoglobinopathy information assistant in at most 120 words. Keep what the patient told you about themselves and the topics already explained."},
+            {"role": "user", "content": f"Summary so far:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"}
+        ],
+        temperature=0.2,
+        max_tokens=200
+    )
+    return response.choices[0].message.content.strip()
+
+def stream_chatbot_response(question, timings=None):
+    """Yield the answer to a question as it is generated.
+
+    If a timings dict is given it is filled in with the seconds spent on
+    retrieval, until the first token and in total, as each becomes known.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    try:
+        context = get_relevant_context(question)
+        timings["retrieval"] = time.perf_counter() - start
+
+        for text in stream_chat_completion(
+            model="gpt-4o",
+            messages=_chatbot_messages(question, context),
+            temperature=0.7
+        ):
+            if "first_token" not in timings:
+                timings["first_token"] = time.perf_counter() - start
+            yield text
+
+        timings["total"] = time.perf_counter() - start
+        print(f"Chatbot response: retrieval {timings['retrieval']:.2f}s, "
+              f"first token {timings.get('first_token', timings['total']):.2f}s, total {timings['total']:.2f}s")
     except Exception as e:
-        raise Exception(f"Error getting chatbot response: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error getting chatbot response: {str(e)}")
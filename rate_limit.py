@@ -0,0 +1,33 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` operations per second with bursts of `capacity`.
+
+    A rate of None or 0 disables limiting. Callers reserve tokens up front,
+    so concurrent callers are spaced out rather than all retrying at once.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate or 0
+        self.capacity = capacity or max(1, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """Take tokens and return how many seconds the caller must wait before using them"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, tokens=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
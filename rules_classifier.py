@@ -0,0 +1,117 @@
+import numpy as np
+
+# Deterministic screening rules for clear-cut hemoglobinopathy results.
+# Only cases that meet every criterion of a rule are classified locally;
+# anything borderline, incomplete or outside the rules goes to the LLM.
+PARAMETERS = ('RBC', 'HGB', 'MCV', 'MCH', 'MCHC', 'RDW',
+              'F_concentration', 'A2_concentration', 'Ao_peak', 'S_peak')
+# A peak area of 0 means the peak is absent; for the other parameters it means "not entered"
+PEAKS = ('Ao_peak', 'S_peak')
+ESCALATE = -1
+
+# Adult HGB reference ranges (g/dL) differ by sex, which reports do not give
+# us. Normal findings need an HGB normal for either sex; values normal for
+# only one sex (e.g. 12.5 or 16.5) are left to the LLM.
+HGB_NORMAL_RANGES = {'female': (12.0, 15.5), 'male': (13.5, 17.5)}
+HGB_NORMAL_ANY_SEX = (max(low for low, _ in HGB_NORMAL_RANGES.values()),
+                      min(high for _, high in HGB_NORMAL_RANGES.values()))
+
+SICKLE_CELL_DISEASE = "Sickle Cell Disease"
+SICKLE_CELL_TRAIT = "Sickle Cell Trait"
+BETA_THALASSEMIA_TRAIT = "Beta Thalassemia Trait"
+NORMAL_FINDINGS = "Normal Findings"
+
+# Checked in order, the first matching rule wins. Alpha thalassemia trait
+# cannot be confirmed from these parameters alone, so it is left to the LLM.
+RULES = (
+    (SICKLE_CELL_DISEASE, [
+        "S peak is at least 80% of the S + Ao area (HbA largely absent)",
+        "HGB below 12 g/dL",
+    ]),
+    (SICKLE_CELL_TRAIT, [
+        "S peak is 25-45% of the S + Ao area, with HbA predominant",
+        "MCV of at least 80 fL and HGB of at least 11 g/dL",
+        "F below 5%",
+    ]),
+    (BETA_THALASSEMIA_TRAIT, [
+        "No S peak",
+        "A2 between 4.0% and 8.0%",
+        "Microcytic, hypochromic indices (MCV below 80 fL, MCH below 27 pg)",
+        "Mentzer index (MCV / RBC) below 13",
+        "F below 5%",
+    ]),
+    (NORMAL_FINDINGS, [
+        "No S peak",
+        "A2 between 1.5% and 3.5% and F below 1%",
+        "RBC, MCV, MCH, MCHC and RDW within reference ranges",
+        f"HGB between {HGB_NORMAL_ANY_SEX[0]} and {HGB_NORMAL_ANY_SEX[1]} g/dL (normal for either sex)",
+    ]),
+)
+
+
+def parameter_matrix(records):
+    """Stack parameter dicts into an (n, 10) float array, with NaN for missing values"""
+    values = np.array(
+        [[record.get(name) if record.get(name) is not None else np.nan for name in PARAMETERS]
+         for record in records],
+        dtype=np.float64
+    ).reshape(-1, len(PARAMETERS))
+    for i, name in enumerate(PARAMETERS):
+        if name not in PEAKS:
+            values[values[:, i] == 0, i] = np.nan
+    return values
+
+
+def _between(values, low, high):
+    return (values >= low) & (values <= high)
+
+
+def classify_matrix(values):
+    """Classify each row of a parameter matrix.
+
+    Returns an array of indices into RULES, with ESCALATE for rows that need
+    the LLM. Comparisons against NaN are false, so missing values never
+    satisfy a rule.
+    """
+    v = {name: values[:, i] for i, name in enumerate(PARAMETERS)}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mentzer = v['MCV'] / v['RBC']
+        s_fraction = v['S_peak'] / (v['S_peak'] + v['Ao_peak'])
+    no_s = s_fraction < 0.02
+
+    masks = [
+        (s_fraction >= 0.8) & (v['HGB'] < 12),
+        _between(s_fraction, 0.25, 0.45) & (v['MCV'] >= 80) & (v['HGB'] >= 11)
+        & (v['F_concentration'] < 5),
+        no_s & _between(v['A2_concentration'], 4.0, 8.0) & (v['MCV'] < 80) & (v['MCH'] < 27)
+        & (mentzer < 13) & (v['F_concentration'] < 5),
+        no_s & _between(v['A2_concentration'], 1.5, 3.5) & (v['F_concentration'] < 1)
+        & _between(v['RBC'], 4.0, 6.0) & _between(v['HGB'], *HGB_NORMAL_ANY_SEX) & _between(v['MCV'], 80, 100)
+        & _between(v['MCH'], 27, 33) & _between(v['MCHC'], 32, 36) & (v['RDW'] <= 14.5),
+    ]
+    return np.select(masks, np.arange(len(RULES)), default=ESCALATE)
+
+
+def classify_parameters(parameters):
+    """Classify one parameter dict, returning (category, criteria) or None if the LLM is needed"""
+    code = int(classify_matrix(parameter_matrix([parameters]))[0])
+    if code == ESCALATE:
+        return None
+    return RULES[code]
+
+
+def format_assessment(parameters, category, criteria):
+    """Assessment text for a rule-based classification, in the style of the LLM's reports"""
+    values = {name: parameters.get(name) for name in PARAMETERS}
+    mentzer = ""
+    if values['MCV'] and values['RBC']:
+        mentzer = f"\nMentzer index (MCV / RBC): {values['MCV'] / values['RBC']:.1f}"
+    met = "\n".join(f"- {criterion}" for criterion in criteria)
+    shown = ", ".join(f"{name}: {value}" for name, value in values.items() if value is not None)
+    return (
+        f"**Classification: {category}**\n\n"
+        f"These results meet every criterion of the rule-based screen for {category}:\n{met}\n\n"
+        f"Values used: {shown}{mentzer}\n\n"
+        "This is an unambiguous pattern, so it was classified without the AI model. "
+        "Confirm against the clinical picture as usual."
+    )
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules live in the repository root; indexing.py in attached_assets
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "attached_assets")]
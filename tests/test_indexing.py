@@ -0,0 +1,100 @@
+import os
+import hashlib
+import random
+import numpy as np
+import pytest
+import embeddings
+import indexing
+
+
+class HashEmbeddingBackend(embeddings.EmbeddingBackend):
+    """Deterministic 8-d vectors, so indexing runs without a model"""
+
+    name = "hash"
+
+    @property
+    def dimension(self):
+        return 8
+
+    def embed(self, texts):
+        return np.array([np.frombuffer(hashlib.sha256(text.encode()).digest()[:8], dtype=np.uint8)
+                         for text in texts], dtype='float32')
+
+
+def write_pdf(path, pages):
+    """Write a minimal PDF with one line of Helvetica text per entry of each page"""
+    objects = ["<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    pages_id = 2 + 2 * len(pages)
+    for lines in pages:
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL\n" + "\n".join(f"({line}) '" for line in lines) + "\nET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 595 842] "
+                       f"/Contents {len(objects)} 0 R /Resources << /Font << /F1 1 0 R >> >> >>")
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    objects.append(f"<< /Type /Catalog /Pages {pages_id} 0 R >>")
+    out, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root {len(objects)} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def book(seed, num_pages):
+    rng = random.Random(seed)
+    words = "alpha beta gamma delta epsilon zeta theta iota kappa lambda sigma omega hemoglobin sickle".split()
+    return [[" ".join(rng.choice(words) for _ in range(12)).capitalize() + "." for _ in range(40)]
+            for _ in range(num_pages)]
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    monkeypatch.setitem(embeddings.BACKENDS, "hash", HashEmbeddingBackend)
+    monkeypatch.setitem(embeddings.DEFAULT_MODELS, "hash", "hash-8")
+    monkeypatch.setenv("EMBEDDING_BACKEND", "hash")
+    data_dir, output_dir = tmp_path / "data", tmp_path / "out"
+    data_dir.mkdir()
+
+    def run():
+        args = indexing.parse_args(["--data-dir", str(data_dir), "--output-dir", str(output_dir),
+                                    "--incremental", "--workers", "1"])
+        indexing.update_index(args)
+        return indexing.load_index_state(str(output_dir), embeddings.get_embedding_backend(),
+                                         "flat", args.chunk_tokens, args.chunk_overlap)
+    return data_dir, run
+
+
+def test_removing_a_file_reindexes_its_near_duplicates(build):
+    data_dir, run = build
+    pages = book(1, 6)
+    write_pdf(data_dir / "guide.pdf", pages)
+    write_pdf(data_dir / "guide_2nd_ed.pdf", pages + book(2, 1))
+    run()
+
+    os.remove(data_dir / "guide.pdf")
+    index, chunks, manifest = run()
+    (entry,) = manifest["files"].values()
+    assert entry["filename"] == "guide_2nd_ed.pdf"
+    assert index.ntotal == entry["end_id"] - entry["start_id"] > 1
+
+
+def test_removing_a_file_while_renaming_its_near_duplicate(build):
+    data_dir, run = build
+    pages = book(1, 6)
+    write_pdf(data_dir / "a.pdf", pages)
+    write_pdf(data_dir / "b.pdf", pages + book(2, 1))
+    run()
+
+    os.remove(data_dir / "a.pdf")
+    os.rename(data_dir / "b.pdf", data_dir / "c.pdf")
+    index, chunks, manifest = run()
+    (entry,) = manifest["files"].values()
+    assert entry["filename"] == "c.pdf"
+    live = [chunk for chunk in chunks if chunk is not None]
+    assert {chunk["filename"] for chunk in live} == {"c.pdf"}
+    assert index.ntotal == len(live)
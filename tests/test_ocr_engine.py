@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from ocr_engine import DEFAULT_THRESHOLD, otsu_threshold, preprocess
+
+
+@pytest.mark.parametrize("level", [0, 255])
+def test_blank_page_is_preprocessed_without_error(level):
+    page = Image.new("L", (400, 600), color=level)
+    assert otsu_threshold(np.asarray(page)) == DEFAULT_THRESHOLD
+    result = preprocess(page)
+    assert result.size == page.size
+    assert result.getextrema() == (level, level)
+
+
+def test_threshold_separates_ink_from_paper():
+    page = Image.new("L", (400, 600), color=230)
+    ImageDraw.Draw(page).rectangle((50, 50, 350, 80), fill=20)
+    threshold = otsu_threshold(np.asarray(page))
+    assert 20 <= threshold < 230
+    assert set(np.unique(np.asarray(preprocess(page)))) == {0, 255}
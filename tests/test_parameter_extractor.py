@@ -0,0 +1,28 @@
+import pytest
+from benchmark_extraction import NORMAL, SICKLE, TRAIT, _analyzer_layout, _narrative_layout, _table_layout
+from parameter_extractor import extract_parameter_details, is_complete, parameter_values
+
+APPENDIX = ["Methodology and reference ranges. Results should be interpreted with the clinical picture."] * 5
+
+
+@pytest.mark.parametrize("layout", [_analyzer_layout, _table_layout, _narrative_layout])
+@pytest.mark.parametrize("values", [NORMAL, TRAIT, SICKLE])
+def test_report_pages_are_read_only_until_every_parameter_is_found(layout, values):
+    pages = layout(values) + APPENDIX
+    read = []
+
+    def lazy_pages():
+        for number, text in enumerate(pages, start=1):
+            read.append(number)
+            yield text
+
+    details = extract_parameter_details(lazy_pages(), stop_when_complete=True)
+    assert is_complete(details)
+    assert parameter_values(details) == values
+    assert len(read) == len(layout(values))
+
+
+def test_bare_hplc_labels_need_an_hplc_table():
+    details = extract_parameter_details("Notes: F 1.2 and A2 3.1 were entered manually")
+    assert details["F_concentration"]["confidence"] < 0.8
+    assert details["A2_concentration"]["confidence"] < 0.8
@@ -1,9 +1,38 @@
 import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from twilio.twiml.messaging_response import MessagingResponse
 from flask import Flask, request
-from rag_chatbot import get_chatbot_response
+from rag_chatbot import get_chatbot_response, summarize_conversation, knowledge_base
+from conversation_memory import ConversationStore
+from message_queue import ShardedWorkerPool
+from idempotency import RecentKeyStore
+from rate_limit import TokenBucket
+from patient_repository import repository
 import re
+import threading
+
+# Outgoing messages: concurrent sends for broadcasts, throttled to the sender number's throughput
+WHATSAPP_SEND_WORKERS = int(os.getenv('WHATSAPP_SEND_WORKERS', '8'))
+WHATSAPP_MESSAGES_PER_SECOND = float(os.getenv('WHATSAPP_MESSAGES_PER_SECOND', '10'))
+WHATSAPP_MAX_LENGTH = 1600  # Longer WhatsApp bodies are rejected by Twilio
+send_rate_limiter = TokenBucket(WHATSAPP_MESSAGES_PER_SECOND)
+
+# Known Twilio error codes and what they mean for the sender
+TWILIO_ERRORS = {
+    "63007": "WhatsApp channel not found. Please ensure the Twilio number is configured for WhatsApp in the Twilio Console",
+    "21211": "Invalid phone number format or not connected to sandbox",
+    "21608": "Number not connected to WhatsApp sandbox",
+}
+
+def _pooled_http_client():
+    """Twilio HTTP client keeping enough connections alive for the send workers"""
+    http_client = TwilioHttpClient(pool_connections=True, timeout=30)
+    http_client.session.mount("https://", HTTPAdapter(pool_maxsize=max(10, WHATSAPP_SEND_WORKERS)))
+    return http_client
 
 # Initialize Twilio client
 try:
@@ -14,7 +43,7 @@ try:
     if not account_sid.startswith('AC'):
         raise ValueError("Invalid Account SID format - should start with 'AC'")
 
-    client = Client(account_sid, auth_token)
+    client = Client(account_sid, auth_token, http_client=_pooled_http_client())
     print("Successfully initialized Twilio client")
 except Exception as e:
     print(f"Error initializing Twilio client: {str(e)}")
@@ -25,6 +54,28 @@ app = Flask(__name__)
 # Store doctor's number
 DOCTOR_NUMBER = "+2347037819697"
 
+# Background workers that answer webhook messages
+WHATSAPP_WORKERS = int(os.getenv('WHATSAPP_WORKERS', '4'))
+WHATSAPP_QUEUE_DEPTH = int(os.getenv('WHATSAPP_QUEUE_DEPTH', '100'))
+WHATSAPP_QUEUE_PATH = os.getenv('WHATSAPP_QUEUE_PATH')
+_message_queue = None
+_message_queue_lock = threading.Lock()
+
+# Twilio retries webhooks it considers failed; repeats of a MessageSid are acknowledged and dropped
+processed_messages = RecentKeyStore(
+    window=int(os.getenv('WHATSAPP_DEDUP_WINDOW', '3600')),
+    path=os.getenv('WHATSAPP_DEDUP_PATH')
+)
+
+# Chat history per sender, summarized as it grows and dropped when idle
+conversations = ConversationStore(
+    summarize=summarize_conversation,
+    max_turns=int(os.getenv('WHATSAPP_HISTORY_TURNS', '6')),
+    token_budget=int(os.getenv('WHATSAPP_HISTORY_TOKENS', '1000')),
+    idle_timeout=int(os.getenv('WHATSAPP_HISTORY_IDLE', '1800')),
+    max_conversations=int(os.getenv('WHATSAPP_MAX_CONVERSATIONS', '10000'))
+)
+
 def validate_phone_number(phone_number):
     """Validate phone number format"""
     # Remove any whitespace and check basic format
@@ -51,120 +102,217 @@ def format_whatsapp_number(phone_number):
             phone_number = '+' + phone_number
 
         # Format for WhatsApp Sandbox/Business API
-        formatted_number = f"whatsapp:{phone_number}"
-        print(f"Formatted WhatsApp number: {formatted_number}")
-        return formatted_number
+        return f"whatsapp:{phone_number}"
     except Exception as e:
         print(f"Error formatting WhatsApp number: {str(e)}")
         raise ValueError("Invalid WhatsApp number format")
 
+@functools.lru_cache(maxsize=1)
+def get_sender_number():
+    """Validated WhatsApp address of the Twilio number, read once per process"""
+    from_number = os.getenv('TWILIO_PHONE_NUMBER')
+    if not from_number:
+        raise ValueError("Twilio phone number not configured")
+    return format_whatsapp_number(validate_phone_number(from_number))
+
+def split_message(body, limit=WHATSAPP_MAX_LENGTH):
+    """Split a message into parts of at most limit characters, preferring line and word breaks"""
+    parts = []
+    while len(body) > limit:
+        cut = body.rfind("\n", 0, limit + 1)
+        if cut < limit // 2:
+            cut = body.rfind(" ", 0, limit + 1)
+        if cut < limit // 2:
+            cut = limit
+        parts.append(body[:cut].rstrip())
+        body = body[cut:].lstrip()
+    parts.append(body)
+    return parts
+
+def _deliver(to_whatsapp, message):
+    """Send a message to one formatted recipient, returning the SIDs of its parts"""
+    from_whatsapp = get_sender_number()
+    sids = []
+    for part in split_message(message):
+        send_rate_limiter.acquire()
+        sids.append(client.messages.create(from_=from_whatsapp, body=part, to=to_whatsapp).sid)
+    return sids
+
+def _describe_twilio_error(error):
+    for code, description in TWILIO_ERRORS.items():
+        if code in str(error):
+            return description
+    return str(error)
+
 def send_whatsapp_message(to_number, message):
     """Send a WhatsApp message using Twilio"""
     try:
-        # Validate phone number
-        to_number = validate_phone_number(to_number)
-        print(f"Attempting to send WhatsApp message to {to_number}")
-
-        # Get Twilio number
-        from_number = os.getenv('TWILIO_PHONE_NUMBER')
-        if not from_number:
-            raise ValueError("Twilio phone number not configured")
+        to_whatsapp = format_whatsapp_number(validate_phone_number(to_number))
+        print(f"Sending WhatsApp message to {to_whatsapp}")
+        sids = _deliver(to_whatsapp, message)
+        print(f"Successfully sent message with SID: {', '.join(sids)}")
+        return True
+    except ValueError as e:
+        print(f"Validation error: {str(e)}")
+        return False
+    except Exception as e:
+        print(f"Error sending WhatsApp message: {_describe_twilio_error(e)}")
+        return False
 
-        # Validate Twilio number format
-        from_number = validate_phone_number(from_number)
-        print(f"Using Twilio number: {from_number}")
+def send_bulk_whatsapp_messages(to_numbers, message):
+    """Send one message to many recipients concurrently.
 
-        # Format numbers for WhatsApp
-        from_whatsapp = format_whatsapp_number(from_number)
-        to_whatsapp = format_whatsapp_number(to_number)
+    Returns a dict mapping each number to its status ("sent", "failed" or
+    "invalid"), the SIDs of the parts sent and an error description.
+    """
+    results = {}
+    recipients = {}
+    for number in to_numbers:
+        try:
+            recipients[number] = format_whatsapp_number(validate_phone_number(number))
+        except ValueError as e:
+            results[number] = {"status": "invalid", "sids": [], "error": str(e)}
 
-        print(f"Sending message from {from_whatsapp} to {to_whatsapp}")
+    try:
+        get_sender_number()
+    except ValueError as e:
+        print(f"Validation error: {str(e)}")
+        results.update({number: {"status": "failed", "sids": [], "error": str(e)} for number in recipients})
+        return results
 
-        # Send message
+    def send_one(to_whatsapp):
         try:
-            message = client.messages.create(
-                from_=from_whatsapp,
-                body=message,
-                to=to_whatsapp
-            )
-            print(f"Successfully sent message with SID: {message.sid}")
-            return True
+            return {"status": "sent", "sids": _deliver(to_whatsapp, message), "error": None}
         except Exception as e:
-            if "63007" in str(e):
-                print("Error: WhatsApp channel not found. Please ensure the Twilio number is configured for WhatsApp in the Twilio Console")
-                return False
-            elif "21211" in str(e):
-                print("Error: Invalid phone number format or not connected to sandbox")
-                return False
-            elif "21608" in str(e):
-                print("Error: Number not connected to WhatsApp sandbox")
-                return False
-            raise e
+            return {"status": "failed", "sids": [], "error": _describe_twilio_error(e)}
 
-    except ValueError as e:
-        print(f"Validation error: {str(e)}")
-        return False
+    with ThreadPoolExecutor(max_workers=WHATSAPP_SEND_WORKERS) as executor:
+        for number, result in zip(recipients, executor.map(send_one, recipients.values())):
+            results[number] = result
+
+    sent = sum(1 for result in results.values() if result["status"] == "sent")
+    print(f"Bulk WhatsApp send: {sent} of {len(results)} recipients succeeded")
+    return results
+
+def latest_results_message(patient_number):
+    """Reply with a patient's most recent measured values and any pathologist review.
+
+    The system assessment is an unreviewed screening result, so it is never
+    sent to patients; only notes a pathologist has written are.
+    """
+    try:
+        if not repository.is_registered(patient_number):
+            return "This number is not registered for results. Please ask your clinic to register it."
+        report = repository.latest_report(patient_number)
+        if report is None:
+            return "No test results are available yet."
+        values = "\n".join(f"{name}: {value}" for name, value in report["parameters"].items() if value is not None)
+        message = f"Your results from {report['report_date']}:\n{values}"
+        if report["pathologist_notes"]:
+            notes = "\n".join(entry["note"] for entry in report["pathologist_notes"])
+            message += f"\n\nPathologist review:\n{notes}"
+        else:
+            message += "\n\nA pathologist has not reviewed these results yet."
+        return message + "\n\nStart a message with 'doctor:' to discuss these results with your doctor."
     except Exception as e:
-        print(f"Error sending WhatsApp message: {str(e)}")
-        return False
+        print(f"Error retrieving results: {str(e)}")
+        return "Sorry, couldn't retrieve your results. Please try again later."
+
+def handle_incoming_message(sender_number, incoming_msg):
+    """Work out the reply to an incoming WhatsApp message"""
+    # Check if message starts with "doctor:" to forward to doctor
+    if incoming_msg.lower().startswith("doctor:"):
+        try:
+            # Forward message to doctor
+            message_to_doctor = f"Patient ({sender_number}): {incoming_msg[7:]}"
+            if send_whatsapp_message(DOCTOR_NUMBER, message_to_doctor):
+                return "Message forwarded to doctor. They will respond soon."
+            return "Sorry, couldn't forward your message to the doctor. Please try again later."
+        except Exception as e:
+            print(f"Error forwarding message to doctor: {str(e)}")
+            return "Error forwarding message. Please try again later."
+
+    # Check if it's the doctor responding (from their registered number)
+    elif sender_number == DOCTOR_NUMBER and ":" in incoming_msg:
+        try:
+            patient_number, message = incoming_msg.split(":", 1)
+            patient_number = validate_phone_number(patient_number.strip())
+            message = message.strip()
+
+            if send_whatsapp_message(patient_number, f"Doctor: {message}"):
+                return "Response sent to patient."
+            return "Failed to send response to patient."
+        except ValueError as e:
+            print(f"Invalid phone number format: {str(e)}")
+            return "Invalid phone number format. Please use format: +1234567890: your message"
+        except Exception as e:
+            print(f"Error processing doctor's response: {str(e)}")
+            return "Error sending response. Please try again with format: patient_number: your message"
+
+    # Registered patients can ask for their latest results
+    elif incoming_msg.strip().lower() == "results":
+        return latest_results_message(sender_number)
+
+    # Otherwise, use chatbot
+    else:
+        try:
+            print("Getting chatbot response")
+            return get_chatbot_response(incoming_msg, conversations.get(sender_number))
+        except Exception as e:
+            print(f"Error getting chatbot response: {str(e)}")
+            return "I'm sorry, I couldn't process your request. Please try again later."
+
+def process_queued_message(payload):
+    """Answer a queued message and deliver the reply through the REST API"""
+    reply = handle_incoming_message(payload["from"], payload["body"])
+    if send_whatsapp_message(payload["from"], reply):
+        print(f"Successfully sent reply to {payload['from']}")
+    else:
+        print(f"Failed to send reply to {payload['from']}")
+    # Summarize long conversations once the reply is on its way
+    conversations.compact(payload["from"])
+
+def get_message_queue():
+    """Return the worker pool answering webhook messages, starting it on first use"""
+    global _message_queue
+    if _message_queue is None:
+        with _message_queue_lock:
+            if _message_queue is None:
+                _message_queue = ShardedWorkerPool(
+                    process_queued_message,
+                    workers=WHATSAPP_WORKERS,
+                    max_depth=WHATSAPP_QUEUE_DEPTH,
+                    path=WHATSAPP_QUEUE_PATH
+                ).start()
+    return _message_queue
 
 @app.route("/whatsapp", methods=['POST'])
 def whatsapp_webhook():
-    """Handle incoming WhatsApp messages"""
+    """Acknowledge incoming WhatsApp messages and queue them for a background reply"""
     try:
         print("Received WhatsApp webhook request")
         # Get incoming message details
         incoming_msg = request.values.get('Body', '')
         sender_number = request.values.get('From', '')
+        message_sid = request.values.get('MessageSid', '')
 
         # Remove WhatsApp prefix if present
         sender_number = sender_number.replace('whatsapp:', '')
         print(f"Message from {sender_number}: {incoming_msg}")
 
-        # Initialize response
-        resp = MessagingResponse()
+        if message_sid and not processed_messages.add(message_sid):
+            print(f"Ignoring repeated delivery of message {message_sid}")
+            return str(MessagingResponse())
 
-        # Check if message starts with "doctor:" to forward to doctor
-        if incoming_msg.lower().startswith("doctor:"):
-            try:
-                # Forward message to doctor
-                message_to_doctor = f"Patient ({sender_number}): {incoming_msg[7:]}"
-                if send_whatsapp_message(DOCTOR_NUMBER, message_to_doctor):
-                    resp.message("Message forwarded to doctor. They will respond soon.")
-                else:
-                    resp.message("Sorry, couldn't forward your message to the doctor. Please try again later.")
-            except Exception as e:
-                print(f"Error forwarding message to doctor: {str(e)}")
-                resp.message("Error forwarding message. Please try again later.")
-
-        # Check if it's the doctor responding (from their registered number)
-        elif sender_number == DOCTOR_NUMBER and ":" in incoming_msg:
-            try:
-                patient_number, message = incoming_msg.split(":", 1)
-                patient_number = validate_phone_number(patient_number.strip())
-                message = message.strip()
-
-                if send_whatsapp_message(patient_number, f"Doctor: {message}"):
-                    resp.message("Response sent to patient.")
-                else:
-                    resp.message("Failed to send response to patient.")
-            except ValueError as e:
-                print(f"Invalid phone number format: {str(e)}")
-                resp.message("Invalid phone number format. Please use format: +1234567890: your message")
-            except Exception as e:
-                print(f"Error processing doctor's response: {str(e)}")
-                resp.message("Error sending response. Please try again with format: patient_number: your message")
-
-        # Otherwise, use chatbot
-        else:
-            try:
-                print("Getting chatbot response")
-                chatbot_response = get_chatbot_response(incoming_msg)
-                resp.message(chatbot_response)
-                print("Successfully sent chatbot response")
-            except Exception as e:
-                print(f"Error getting chatbot response: {str(e)}")
-                resp.message("I'm sorry, I couldn't process your request. Please try again later.")
+        # Replies are sent by the workers, so Twilio gets an empty response straight away.
+        # Messages from one sender are answered in the order they arrived.
+        resp = MessagingResponse()
+        if not get_message_queue().submit(sender_number, {"from": sender_number, "body": incoming_msg}):
+            print("Message queue is full, asking sender to try again later")
+            # The message was not processed, so a redelivery should be
+            if message_sid:
+                processed_messages.discard(message_sid)
+            resp.message("We're receiving a lot of messages right now. Please try again in a few minutes.")
 
         return str(resp)
 
@@ -175,4 +323,7 @@ def whatsapp_webhook():
 if __name__ == "__main__":
     # Only run the Flask app when deployed separately (e.g., on Azure)
     if os.getenv('DEPLOY_WHATSAPP_SERVER', 'false').lower() == 'true':
+        knowledge_base.warm_up()
+        # Start the workers now so messages queued before a restart are answered
+        get_message_queue()
         app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
\ No newline at end of file